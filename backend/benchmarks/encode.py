@@ -0,0 +1,101 @@
+"""
+Frame encoding benchmark
+
+Measures the CPU time a broadcast to 1k subscribed sockets costs when the
+frame is encoded with json for every recipient (how frames used to be
+built) and when it is encoded once with the app's encoder and the cached
+frame is shared. No database or network is involved, frames only reach
+the outbound queues.
+
+    cd backend
+    python -m benchmarks.encode
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "chat_encode_bench.db"),
+)
+
+from chat.broker import MemoryBroker  # noqa: E402
+from chat.cache import frame_cache  # noqa: E402
+from chat.connection import Connection, ConnectionManager  # noqa: E402
+from chat.models import Message  # noqa: E402
+from chat.utils.encoding import orjson  # noqa: E402
+from chat.views.websocket import message_frame, message_payload  # noqa: E402
+
+
+def prepare_manager(recipients: int, broadcasts: int) -> ConnectionManager:
+    manager = ConnectionManager(MemoryBroker())
+
+    async def subscribe() -> None:
+        for user_id in range(recipients):
+            connection = Connection(None, user_id, max_queue=broadcasts * 2)
+            manager.connect(connection)
+            await manager.subscribe(connection, 1)
+
+    asyncio.run(subscribe())
+    return manager
+
+
+def per_recipient(manager: ConnectionManager, message: Message) -> None:
+    for connection in manager.subscribers(1):
+        connection.push(json.dumps(message_payload(message)), 1, message.id)
+
+
+def shared(manager: ConnectionManager, message: Message) -> None:
+    frame_cache.invalidate(message.id)
+    manager.publish(1, message_frame(message), message.id)
+
+
+def measure(broadcast, manager: ConnectionManager, broadcasts: int) -> float:
+    """CPU milliseconds per broadcast"""
+    message = Message(
+        id=1,
+        text="hello from the encoding benchmark " * 4,
+        sender_name="bench",
+        group_id=1,
+        created_at=datetime.utcnow(),
+    )
+    started = time.process_time()
+    for _ in range(broadcasts):
+        broadcast(manager, message)
+    elapsed = time.process_time() - started
+    for connection in manager.subscribers(1):
+        connection.drain()
+    return elapsed * 1000 / broadcasts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--recipients",
+        type=int,
+        default=1_000,
+        help="sockets subscribed to the group",
+    )
+    parser.add_argument(
+        "--broadcasts",
+        type=int,
+        default=200,
+        help="broadcasts to time per mode",
+    )
+    args = parser.parse_args()
+
+    manager = prepare_manager(args.recipients, args.broadcasts)
+    before = measure(per_recipient, manager, args.broadcasts)
+    after = measure(shared, manager, args.broadcasts)
+    print(f"encoder: {'orjson' if orjson else 'json'}")
+    print(f"{args.recipients} recipients, CPU ms per broadcast")
+    print(f"{'json per recipient':>22} {before:>8.3f}")
+    print(f"{'encoded once':>22} {after:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
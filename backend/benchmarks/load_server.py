@@ -0,0 +1,83 @@
+"""
+Server side of the load test (benchmarks.load starts it)
+
+The chat app as `python -m chat.server` runs it, plus a counter of the SQL
+statements it executes and GET /bench/stats, which reports them with the
+resident memory of the process. Migrates DATABASE_URL before it starts.
+
+    cd backend
+    python -m benchmarks.load_server --port 8001
+"""
+import argparse
+import os
+import resource
+import time
+
+import uvicorn
+from sqlalchemy import event
+
+from chat.database import async_engine, engine
+from chat.migrations import migrate
+from chat.server import ChatWebSocketProtocol
+from main import app
+
+
+class QueryCounter:
+    """statements run by an engine and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+        self.seconds += time.perf_counter() - conn.info["query_started"].pop()
+
+    def listen(self, sync_engine) -> None:
+        event.listen(sync_engine, "before_cursor_execute", self.before)
+        event.listen(sync_engine, "after_cursor_execute", self.after)
+
+
+counter = QueryCounter()
+counter.listen(async_engine.sync_engine)
+
+
+def rss_bytes() -> int:
+    """resident memory now, or the peak where /proc isn't there"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@app.get("/bench/stats")
+async def bench_stats():
+    """SQL statements run so far and resident memory of the server"""
+    return {
+        "queries": counter.queries,
+        "query_seconds": counter.seconds,
+        "rss_bytes": rss_bytes(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    migrate(engine)
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        ws=ChatWebSocketProtocol,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
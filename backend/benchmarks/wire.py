@@ -0,0 +1,123 @@
+"""
+Wire format benchmark
+
+Encodes a stream of chat messages the way a socket sends them and reports
+payload bytes and CPU time per message for JSON text and MessagePack
+binary frames, each plain, with websockets' default permessage-deflate
+and with the deflate settings of `python -m chat.server`. Live messages
+go one per frame, replays in Batch frames.
+
+    cd backend
+    python -m benchmarks.wire
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "chat_wire_bench.db"),
+)
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate  # noqa: E402
+from websockets.frames import OP_BINARY, OP_TEXT, Frame  # noqa: E402
+
+from chat.models import Message  # noqa: E402
+from chat.server import ThresholdPerMessageDeflate  # noqa: E402
+from chat.setting import setting  # noqa: E402
+from chat.utils.encoding import encode_frame, packed  # noqa: E402
+from chat.views.websocket import (  # noqa: E402
+    batch_frames,
+    message_frames,
+    message_payload,
+)
+
+WORDS = (
+    "hi hello ok sure thanks see you tomorrow meeting lunch today where are "
+    "the docs deploy failed again looks good to me merged ping pong :)"
+).split()
+
+
+def make_messages(count: int) -> list[Message]:
+    started = datetime(2024, 3, 1)
+    rng = random.Random(0)
+    return [
+        Message(
+            id=index + 1,
+            text=" ".join(rng.choices(WORDS, k=rng.randint(1, 30))),
+            sender_name=rng.choice(("alice", "bob", "carol", "dave")),
+            group_id=1,
+            created_at=started + timedelta(seconds=index * 7),
+        )
+        for index in range(count)
+    ]
+
+
+def deflate(tuned: bool) -> PerMessageDeflate:
+    if tuned:
+        return ThresholdPerMessageDeflate(
+            False,
+            False,
+            15,
+            setting.WS_DEFLATE_WINDOW_BITS,
+            {"memLevel": setting.WS_DEFLATE_MEM_LEVEL},
+            threshold=setting.WS_DEFLATE_THRESHOLD,
+        )
+    return PerMessageDeflate(False, False, 15, 15)
+
+
+def measure(
+    messages: list[Message], binary: bool, compression: str, batched: bool
+) -> tuple[float, float]:
+    """payload bytes and CPU microseconds per message"""
+    extension = None if compression == "none" else deflate(compression == "tuned")
+    total = 0
+    started = time.process_time()
+    if batched:
+        frames = [frame for frame, _, _ in batch_frames(1, message_frames(messages))]
+    else:
+        frames = [encode_frame(message_payload(message)) for message in messages]
+    for frame in frames:
+        data = packed(frame) if binary else frame.encode()
+        if extension is not None:
+            data = extension.encode(
+                Frame(OP_BINARY if binary else OP_TEXT, data)
+            ).data
+        total += len(data)
+    elapsed = time.process_time() - started
+    return total / len(messages), elapsed * 1_000_000 / len(messages)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--messages",
+        type=int,
+        default=5_000,
+        help="messages to encode per format",
+    )
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    # warm up the encoders
+    measure(messages, binary=True, compression="tuned", batched=False)
+    print(
+        f"{'frames':>6} {'format':>8} {'deflate':>8}"
+        f" {'bytes/msg':>10} {'cpu us/msg':>11}"
+    )
+    for batched in (False, True):
+        for binary in (False, True):
+            for compression in ("none", "default", "tuned"):
+                size, cpu = measure(messages, binary, compression, batched)
+                print(
+                    f"{'batch' if batched else 'live':>6}"
+                    f" {'msgpack' if binary else 'json':>8}"
+                    f" {compression:>8} {size:>10.1f} {cpu:>11.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
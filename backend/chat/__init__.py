@@ -1,12 +1,16 @@
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from chat.utils.encoding import orjson
 
 __version__ = "1"
 app = FastAPI(
     title="ChatProvider",
     description="A ChatProvider Based on WebSocket",
     version=__version__,
+    default_response_class=JSONResponse if orjson is None else ORJSONResponse,
 )
 app.add_middleware(
     CORSMiddleware,
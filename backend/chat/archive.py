@@ -0,0 +1,358 @@
+"""
+Cold storage of old messages
+
+`python -m chat.manage archive-messages` moves the messages older than
+ARCHIVE_AFTER_DAYS out of the messages table, one calendar month (UTC) at
+a time and oldest first, so the table only holds recent ones and stays in
+cache. Each month becomes an immutable segment in ARCHIVE_DIR, recorded in
+the message_segments table:
+
+- <name>.ndjson.gz, the messages as JSON lines in id order, compressed in
+  blocks of ARCHIVE_BLOCK_ROWS lines; every block is a gzip member of its
+  own, so one can be read without the others and zcat still reads the file
+- <name>.index.json, the sparse index: first id, last id, offset and size
+  of each block, the blocks each group has messages in, and a bloom filter
+  of the words of each block, so a search only reads the blocks that may
+  have all of its words
+
+Archived messages are older than every message left in the table. History
+and search read them once the table has nothing older left for the page,
+and count them as read. They can't be edited or deleted anymore.
+"""
+import base64
+import gzip
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice, takewhile
+from typing import Iterable, Iterator, NamedTuple
+
+from sqlalchemy import delete, func, select
+
+from chat import logger, models
+from chat.database import SessionLocal
+from chat.setting import setting
+from chat.utils.encoding import dumps, loads
+
+WORD = re.compile(r"\w+")
+
+
+class Block(NamedTuple):
+    first_id: int
+    last_id: int
+    offset: int
+    size: int
+
+
+class TermFilter:
+    """
+    bloom filter of the words of a block, about 1% false positives and
+    never a false negative
+    """
+
+    BITS_PER_WORD = 10
+    HASHES = 7
+
+    def __init__(self, bits: bytes):
+        self.bits = bytearray(bits)
+
+    @classmethod
+    def of(cls, terms: set[str]) -> "TermFilter":
+        term_filter = cls(bytes(max(1, len(terms) * cls.BITS_PER_WORD // 8)))
+        for term in terms:
+            for position in term_filter.positions(term):
+                term_filter.bits[position // 8] |= 1 << position % 8
+        return term_filter
+
+    def positions(self, term: str) -> Iterator[int]:
+        digest = hashlib.blake2b(term.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        size = len(self.bits) * 8
+        for number in range(self.HASHES):
+            yield (first + number * step) % size
+
+    def __contains__(self, term: str) -> bool:
+        return all(
+            self.bits[position // 8] >> position % 8 & 1
+            for position in self.positions(term)
+        )
+
+    def encode(self) -> str:
+        return base64.b64encode(self.bits).decode()
+
+    @classmethod
+    def decode(cls, data: str) -> "TermFilter":
+        return cls(base64.b64decode(data))
+
+
+class SegmentIndex(NamedTuple):
+    blocks: list[Block]
+    # group id -> numbers of the blocks holding its messages, in id order
+    groups: dict[int, list[int]]
+    # the words of each block, None for segments written without them
+    terms: list[TermFilter] | None
+
+
+def segment_path(name: str, extension: str) -> str:
+    return os.path.join(setting.ARCHIVE_DIR, name + extension)
+
+
+def words(text: str) -> set[str]:
+    """lowercase words of a text, what the search indexes of the table match"""
+    return set(WORD.findall(text.lower()))
+
+
+def chunks(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_segment(name: str, rows: Iterable[dict]) -> dict:
+    """
+    write message rows, in id order, to a segment and its index
+    the files are renamed into place once complete
+
+    output:
+    - first_id, last_id, first_created_at, last_created_at and messages of
+      the segment
+    """
+    os.makedirs(setting.ARCHIVE_DIR, exist_ok=True)
+    path = segment_path(name, ".ndjson.gz")
+    index_path = segment_path(name, ".index.json")
+    blocks: list[Block] = []
+    groups: dict[int, list[int]] = {}
+    terms: list[TermFilter] = []
+    first = last = None
+    messages = 0
+    with open(path + ".tmp", "wb") as file:
+        for chunk in chunks(rows, setting.ARCHIVE_BLOCK_ROWS):
+            lines = "".join(
+                dumps(
+                    {
+                        "id": row["id"],
+                        "text": row["text"],
+                        "created_at": row["created_at"].isoformat(),
+                        "sender_id": row["sender_id"],
+                        "sender_name": row["sender_name"],
+                        "group_id": row["group_id"],
+                    }
+                )
+                + "\n"
+                for row in chunk
+            )
+            data = gzip.compress(lines.encode(), mtime=0)
+            number = len(blocks)
+            blocks.append(
+                Block(chunk[0]["id"], chunk[-1]["id"], file.tell(), len(data))
+            )
+            file.write(data)
+            for group_id in {row["group_id"] for row in chunk}:
+                groups.setdefault(group_id, []).append(number)
+            terms.append(
+                TermFilter.of(set().union(*(words(row["text"] or "") for row in chunk)))
+            )
+            first = first or chunk[0]
+            last = chunk[-1]
+            messages += len(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    with open(index_path + ".tmp", "w") as file:
+        file.write(
+            dumps(
+                {
+                    "blocks": [list(block) for block in blocks],
+                    "groups": groups,
+                    "terms": [term_filter.encode() for term_filter in terms],
+                }
+            )
+        )
+    os.replace(path + ".tmp", path)
+    os.replace(index_path + ".tmp", index_path)
+    return {
+        "first_id": first["id"],
+        "last_id": last["id"],
+        "first_created_at": first["created_at"],
+        "last_created_at": last["created_at"],
+        "messages": messages,
+    }
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment: datetime) -> datetime:
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+def archive_month(before: datetime) -> dict | None:
+    """
+    move the oldest month left in the table to a segment, if it ends by
+    `before`
+
+    output:
+    - name of the segment and what write_segment returns, None when there
+      is no such month
+    """
+    with SessionLocal() as db:
+        oldest = db.execute(
+            select(models.Message.id, models.Message.created_at)
+            .order_by(models.Message.id)
+            .limit(1)
+        ).first()
+        # the newest message stays: sqlite numbers new rows after the biggest
+        # id left in the table, which could be an archived one
+        newest_id = db.scalar(select(func.max(models.Message.id)))
+        if oldest is None or oldest.id == newest_id or oldest.created_at >= before:
+            return None
+        end = next_month(oldest.created_at)
+        name = f"messages-{oldest.created_at:%Y-%m}-{oldest.id}"
+        rows = db.execute(
+            select(
+                models.Message.id,
+                models.Message.text,
+                models.Message.created_at,
+                models.Message.sender_id,
+                models.Message.sender_name,
+                models.Message.group_id,
+            )
+            .where(models.Message.id < newest_id)
+            .order_by(models.Message.id)
+            .execution_options(yield_per=setting.ARCHIVE_BLOCK_ROWS)
+        ).mappings()
+        segment = write_segment(
+            name, takewhile(lambda row: row["created_at"] < end, rows)
+        )
+        rows.close()
+        archived = (segment["first_id"], segment["last_id"])
+        db.add(models.MessageSegment(name=name, **segment))
+        db.execute(
+            delete(models.UnreadMessage).where(
+                models.UnreadMessage.message_id.between(*archived)
+            )
+        )
+        db.execute(delete(models.Message).where(models.Message.id.between(*archived)))
+        db.commit()
+    logger.info("Archived %s messages to %s", segment["messages"], name)
+    return {"name": name, **segment}
+
+
+def archive_messages(older_than_days: int = setting.ARCHIVE_AFTER_DAYS) -> list[dict]:
+    """
+    move every whole month older than `older_than_days` to a segment
+
+    output:
+    - the segments written, oldest first
+    """
+    before = month_start(datetime.utcnow() - timedelta(days=older_than_days))
+    segments = []
+    while (segment := archive_month(before)) is not None:
+        segments.append(segment)
+    return segments
+
+
+@lru_cache(maxsize=setting.ARCHIVE_INDEX_CACHE_SIZE)
+def segment_index(name: str) -> SegmentIndex:
+    """the index of a segment, kept once read since segments never change"""
+    with open(segment_path(name, ".index.json"), "rb") as file:
+        index = loads(file.read())
+    terms = index.get("terms")
+    if terms is not None:
+        terms = [TermFilter.decode(data) for data in terms]
+    return SegmentIndex(
+        blocks=[Block(*block) for block in index["blocks"]],
+        groups={int(group_id): blocks for group_id, blocks in index["groups"].items()},
+        terms=terms,
+    )
+
+
+def group_records(
+    name: str,
+    group_id: int,
+    after_id: int | None,
+    before_id: int | None,
+    descending: bool,
+    terms: set[str] = frozenset(),
+) -> Iterator[dict]:
+    """
+    the group's messages in a segment between the ids, reading only the
+    blocks that hold some of them, and may have every word of `terms`
+    """
+    index = segment_index(name)
+    numbers = index.groups.get(group_id, [])
+    with open(segment_path(name, ".ndjson.gz"), "rb") as file:
+        for number in reversed(numbers) if descending else numbers:
+            block = index.blocks[number]
+            if after_id is not None and block.last_id <= after_id:
+                continue
+            if before_id is not None and block.first_id >= before_id:
+                continue
+            if index.terms is not None and not all(
+                term in index.terms[number] for term in terms
+            ):
+                continue
+            file.seek(block.offset)
+            lines = gzip.decompress(file.read(block.size)).splitlines()
+            for line in reversed(lines) if descending else lines:
+                record = loads(line)
+                if (
+                    record["group_id"] == group_id
+                    and (after_id is None or record["id"] > after_id)
+                    and (before_id is None or record["id"] < before_id)
+                ):
+                    yield record
+
+
+def read_messages(
+    segments: list[str],
+    group_id: int,
+    after_id: int | None = None,
+    before_id: int | None = None,
+    limit: int | None = None,
+    query: str | None = None,
+) -> list[models.Message]:
+    """
+    archived messages of a group, oldest first, not attached to a session
+    - segments: names of the segments to read, in id order
+    - after_id: the first `limit` messages after this one, the last `limit`
+      messages otherwise
+    - before_id: only messages before this one
+    - query: only the messages with every word of it
+    """
+    terms = words(query) if query is not None else set()
+    if query is not None and not terms:
+        return []
+    descending = after_id is None
+
+    def matching() -> Iterator[dict]:
+        for name in reversed(segments) if descending else segments:
+            records = group_records(
+                name, group_id, after_id, before_id, descending, terms
+            )
+            for record in records:
+                if terms <= words(record["text"] or ""):
+                    yield record
+
+    records = list(islice(matching(), limit))
+    if descending:
+        records.reverse()
+    return [
+        models.Message(
+            id=record["id"],
+            text=record["text"],
+            created_at=datetime.fromisoformat(record["created_at"]),
+            sender_id=record["sender_id"],
+            sender_name=record["sender_name"],
+            group_id=record["group_id"],
+        )
+        for record in records
+    ]
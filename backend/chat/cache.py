@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, NamedTuple, TypeVar
+
+from chat.models import UserRole
+from chat.schema import User
+from chat.setting import setting
+
+Value = TypeVar("Value")
+
+
+class TTLCache(Generic[Value]):
+    """
+    In-process LRU cache whose entries also expire after `ttl` seconds
+
+    Writers invalidate the keys they change. The TTL only bounds how stale an
+    entry can get when another process made the change.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires at, stored at, value)
+        self.entries: OrderedDict[Hashable, tuple[float, float, Value]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Value | None:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def age(self, key: Hashable) -> float | None:
+        """seconds since the entry was stored, None when there is none"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[1]
+
+    def set(self, key: Hashable, value: Value, ttl: float | None = None) -> None:
+        """ttl overrides the cache's TTL when it is shorter"""
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        now = time.monotonic()
+        self.entries[key] = (now + ttl, now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self.entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Value], bool]) -> None:
+        """drop every entry whose value matches, for writes that aren't keyed"""
+        for key, (_, _, value) in list(self.entries.items()):
+            if predicate(value):
+                del self.entries[key]
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RosterMember(NamedTuple):
+    """a group member as the roster cache keeps it, id is the user id"""
+
+    id: int
+    username: str
+    role: UserRole
+
+
+# group_id -> {user_id: RosterMember}
+Roster = dict[int, RosterMember]
+
+roster_cache: TTLCache[Roster] = TTLCache(
+    maxsize=setting.ROSTER_CACHE_SIZE, ttl=setting.ROSTER_CACHE_TTL
+)
+
+# verified token -> snapshot of its user, see chat.utils.jwt.get_current_user
+principal_cache: TTLCache[User] = TTLCache(
+    maxsize=setting.PRINCIPAL_CACHE_SIZE, ttl=setting.PRINCIPAL_CACHE_TTL
+)
+
+# message id -> encoded Text frame, see chat.views.websocket.message_frame
+frame_cache: TTLCache[str] = TTLCache(
+    maxsize=setting.FRAME_CACHE_SIZE, ttl=setting.FRAME_CACHE_TTL
+)
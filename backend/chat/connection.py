@@ -0,0 +1,435 @@
+import asyncio
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from chat import logger, metrics
+from chat.broker import Broker, broker
+from chat.setting import setting
+from chat.utils.encoding import encode_frame, loads, packed, unpack
+
+# queued item: (group_id, message_id, frame, perf_counter when queued,
+# first_id); message_id is the frame's last message and first_id its first,
+# they differ for Batch frames; ids are None for other frames, change and
+# Resync frames only have the group
+OutboundFrame = tuple[int | None, int | None, str, float, int | None]
+# tells the writer to close the socket
+CLOSE = (None, None, "", 0.0, None)
+
+
+class OverflowPolicy:
+    """what a connection does when its outbound queue is full"""
+
+    # drop the oldest queued frame to make room
+    drop_oldest = "drop_oldest"
+    # replace everything queued with one Resync frame per group
+    coalesce = "coalesce"
+    # drop the socket and tell the client where to resume from
+    disconnect = "disconnect"
+
+
+class Connection:
+    """
+    One open client socket, the groups it listens to and its outbound queue
+
+    Broadcasts only ever put frames on the bounded queue and a single writer
+    sends them, so a slow client can't hold up the rest of its group or
+    grow memory past OUTBOUND_QUEUE_SIZE frames.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_queue: int = setting.OUTBOUND_QUEUE_SIZE,
+        policy: str = setting.OUTBOUND_OVERFLOW_POLICY,
+        binary: bool = False,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # msgpack subprotocol, frames go out as MessagePack binary messages
+        self.binary = binary
+        self.groups: set[int] = set()
+        self.queue: asyncio.Queue[OutboundFrame] = asyncio.Queue(max_queue)
+        self.policy = policy
+        self.closing = False
+        self.dropped = 0
+        # last message id sent on this socket, per group
+        self.sent_ids: dict[int, int] = {}
+        # after_id of the Resync frames queued and not sent yet, per group
+        self.resyncs: dict[int, int | None] = {}
+        # groups whose replay is being read, with the live frames held back
+        # until it is queued; None once more came than the queue holds
+        self.held: dict[int, list[OutboundFrame] | None] = {}
+        # last replayed message id per group, until the client acks it
+        self.unacked: dict[int, int] = {}
+
+    @property
+    def depth(self) -> int:
+        """number of frames waiting to be sent"""
+        return self.queue.qsize()
+
+    def push(
+        self,
+        frame: str,
+        group_id: int | None = None,
+        message_id: int | None = None,
+    ) -> bool:
+        """
+        queue a frame for this socket without waiting
+
+        output:
+        - False if the frame won't reach the client
+        """
+        if self.closing:
+            return False
+        item = (group_id, message_id, frame, time.perf_counter(), message_id)
+        if group_id in self.held:
+            return self.hold(item)
+        return self.enqueue(item)
+
+    def enqueue(self, item: OutboundFrame) -> bool:
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            return self.overflow(item)
+
+    def begin_replay(self, group_id: int) -> None:
+        """
+        hold the group's live frames back until end_replay, so they go out
+        after the replayed messages; call it before subscribing
+        """
+        self.held[group_id] = []
+
+    def hold(self, item: OutboundFrame) -> bool:
+        group_id = item[0]
+        held = self.held[group_id]
+        if held is None:
+            # the Resync queued after the replay covers it
+            return True
+        if len(held) < self.queue.maxsize:
+            held.append(item)
+            return True
+        self.dropped += len(held) + 1
+        self.held[group_id] = None
+        return True
+
+    def end_replay(self, group_id: int, last_id: int | None) -> None:
+        """
+        queue the live frames held during the replay of a group, leaving out
+        the messages the replay had (up to last_id)
+        """
+        if group_id not in self.held:
+            return
+        held = self.held.pop(group_id)
+        if held is None:
+            if last_id is None:
+                last_id = self.sent_ids.get(group_id)
+            self.resyncs[group_id] = last_id
+            self.enqueue(self.resync_item(group_id, last_id))
+            return
+        for item in held:
+            message_id = item[1]
+            if message_id is None or last_id is None or message_id > last_id:
+                self.enqueue(item)
+
+    def replaying(self, group_id: int) -> bool:
+        """the group's replay is being read or isn't acked yet"""
+        return group_id in self.held or group_id in self.unacked
+
+    def acked(self, group_id: int, message_id: int) -> bool:
+        """
+        record an ack of the group up to message_id
+
+        output:
+        - True if it finishes the group's replay
+        """
+        unacked = self.unacked.get(group_id)
+        if unacked is None or message_id < unacked:
+            return False
+        del self.unacked[group_id]
+        return True
+
+    def resync_item(self, group_id: int, after_id: int | None) -> OutboundFrame:
+        frame = encode_frame(
+            {"type": "Resync", "group_id": group_id, "after_id": after_id}
+        )
+        return (group_id, None, frame, time.perf_counter(), None)
+
+    async def put(
+        self,
+        frame: str,
+        group_id: int | None = None,
+        message_id: int | None = None,
+        first_id: int | None = None,
+    ) -> None:
+        """
+        queue a frame, waiting for room instead of overflowing
+        - message_id: its last message, first_id its first (for Batch frames)
+        """
+        if first_id is None:
+            first_id = message_id
+        if not self.closing:
+            await self.queue.put(
+                (group_id, message_id, frame, time.perf_counter(), first_id)
+            )
+
+    def overflow(self, item: OutboundFrame) -> bool:
+        self.dropped += 1
+        if self.policy == OverflowPolicy.drop_oldest:
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+            return True
+        pending = self.drain() + [item]
+        if self.policy == OverflowPolicy.coalesce:
+            for group_id, after_id in self.resume_points(pending).items():
+                self.resyncs[group_id] = after_id
+                self.queue.put_nowait(self.resync_item(group_id, after_id))
+            # the client fetches what it missed, so the frame counts as delivered
+            return True
+        logger.warning(
+            "Disconnect slow consumer user %s, %s frames pending",
+            self.user_id,
+            len(pending),
+        )
+        self.closing = True
+        self.queue.put_nowait(
+            (
+                None,
+                None,
+                encode_frame({"type": "Resume", "groups": self.resume_points(pending)}),
+                time.perf_counter(),
+                None,
+            )
+        )
+        self.queue.put_nowait(CLOSE)
+        return False
+
+    def drain(self) -> list[OutboundFrame]:
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return items
+
+    def resume_points(self, pending: list[OutboundFrame]) -> dict[int, int | None]:
+        """
+        the last message id the client got for each group with pending frames
+        None when nothing was sent for that group yet; a pending Resync keeps
+        the point it was made with; with nothing sent, the client resumes
+        before the first message of the oldest pending frame, all of a Batch
+        """
+        points = {}
+        for group_id, _, _, _, first_id in pending:
+            if group_id is None or group_id in points:
+                continue
+            if group_id in self.resyncs:
+                points[group_id] = self.resyncs[group_id]
+                continue
+            after_id = self.sent_ids.get(group_id)
+            if after_id is None and first_id is not None:
+                after_id = first_id - 1
+            points[group_id] = after_id
+        return points
+
+    async def send(self, frame: str) -> None:
+        """send a frame right away, in the socket's format"""
+        if self.binary:
+            await self.websocket.send_bytes(packed(frame))
+        else:
+            await self.websocket.send_text(frame)
+
+    async def receive(self) -> dict:
+        """read the next client frame, JSON text or MessagePack binary"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            data = unpack(message["bytes"])
+        else:
+            data = loads(message["text"])
+        if not isinstance(data, dict):
+            raise ValueError("frames are objects")
+        return data
+
+    async def write(self) -> None:
+        """the connection's writer, send queued frames in order"""
+        while True:
+            item = await self.queue.get()
+            if item is CLOSE:
+                await self.websocket.close(code=4408, reason="Slow consumer")
+                return
+            group_id, message_id, frame, queued_at, _ = item
+            await self.send(frame)
+            metrics.send_latency_seconds.observe(time.perf_counter() - queued_at)
+            if message_id is not None:
+                self.sent_ids[group_id] = message_id
+            if group_id is not None:
+                # a pending Resync is the first queued frame of its group
+                self.resyncs.pop(group_id, None)
+
+
+class RecentMessages:
+    """
+    Frames of the last messages broadcast to a group, oldest first
+
+    Kept only while the group has local subscribers, since that is when the
+    broker sends this node every message of the group. It then holds every
+    message with an id above `floor`, which moves up as old frames make
+    room for new ones, so a socket that saw up to `floor` or later can
+    resume from memory. Until the first message arrives nothing is known.
+    """
+
+    def __init__(self, size: int = setting.RECENT_MESSAGES_SIZE):
+        self.size = size
+        self.frames: dict[int, str] = {}
+        self.floor: int | None = None
+
+    def add(self, message_id: int, frame: str) -> None:
+        if self.floor is None:
+            self.floor = message_id - 1
+        self.frames[message_id] = frame
+        if len(self.frames) > self.size:
+            oldest = next(iter(self.frames))
+            del self.frames[oldest]
+            self.floor = max(self.floor, oldest)
+
+    def change(self, message_id: int, new_text: str | None) -> None:
+        """an edited message gets its new text, a deleted one (None) goes"""
+        frame = self.frames.get(message_id)
+        if frame is None:
+            return
+        if new_text is None:
+            del self.frames[message_id]
+            return
+        payload = loads(frame)
+        payload["text"] = new_text
+        self.frames[message_id] = encode_frame(payload)
+
+    def since(self, last_seen_id: int) -> list[tuple[int, str]] | None:
+        """
+        (message id, frame) pairs of the messages after last_seen_id, oldest
+        first; None when some of them may have fallen out already
+        """
+        if self.floor is None or last_seen_id < self.floor:
+            return None
+        return sorted(
+            (message_id, frame)
+            for message_id, frame in self.frames.items()
+            if message_id > last_seen_id
+        )
+
+
+class ConnectionManager:
+    """
+    Registry of live sockets in this process
+
+    - user_connections: every socket a user has open (one per device)
+    - group_subscribers: the sockets subscribed to a group, so a broadcast
+      only touches the sockets that actually listen to that group
+    - recent: the last messages of every group with local subscribers
+
+    The broker is subscribed to a group while it has at least one local
+    subscriber, so other nodes only send us events we can deliver.
+    """
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        self.user_connections: dict[int, set[Connection]] = {}
+        self.group_subscribers: dict[int, set[Connection]] = {}
+        self.recent: dict[int, RecentMessages] = {}
+
+    def connect(self, connection: Connection) -> None:
+        self.user_connections.setdefault(connection.user_id, set()).add(connection)
+
+    async def disconnect(self, connection: Connection) -> None:
+        for group_id in list(connection.groups):
+            await self.unsubscribe(connection, group_id)
+        connections = self.user_connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.user_connections[connection.user_id]
+
+    async def subscribe(self, connection: Connection, group_id: int) -> None:
+        connection.groups.add(group_id)
+        subscribers = self.group_subscribers.setdefault(group_id, set())
+        subscribers.add(connection)
+        if len(subscribers) == 1:
+            self.recent[group_id] = RecentMessages()
+            await self.broker.subscribe(group_id)
+
+    async def unsubscribe(self, connection: Connection, group_id: int) -> None:
+        connection.groups.discard(group_id)
+        connection.unacked.pop(group_id, None)
+        subscribers = self.group_subscribers.get(group_id)
+        if subscribers is not None and connection in subscribers:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.group_subscribers[group_id]
+                self.recent.pop(group_id, None)
+                await self.broker.unsubscribe(group_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.user_connections
+
+    def subscribers(self, group_id: int) -> set[Connection]:
+        return self.group_subscribers.get(group_id, set())
+
+    def replaying(self, group_id: int) -> set[int]:
+        """
+        ids of the users with a socket replaying the group, live messages
+        mustn't mark it read for them past what the replay has (see
+        Connection.replaying)
+        """
+        return {
+            connection.user_id
+            for connection in self.subscribers(group_id)
+            if connection.replaying(group_id)
+        }
+
+    def publish(
+        self, group_id: int, frame: str, message_id: int | None = None
+    ) -> set[int]:
+        """
+        queue a frame on every socket subscribed to the group, message
+        frames are also kept with the group's recent messages
+
+        output:
+        - ids of the users that received the frame
+        """
+        recent = self.recent.get(group_id)
+        if recent is not None and message_id is not None:
+            recent.add(message_id, frame)
+        delivered = set()
+        for connection in self.subscribers(group_id):
+            if connection.push(frame, group_id, message_id):
+                delivered.add(connection.user_id)
+        if message_id is not None:
+            metrics.messages_delivered.inc(len(delivered))
+        return delivered
+
+    def message_changed(
+        self, group_id: int, message_id: int, new_text: str | None
+    ) -> None:
+        """keep the recent messages up to date, new_text is None on delete"""
+        recent = self.recent.get(group_id)
+        if recent is not None:
+            recent.change(message_id, new_text)
+
+    def recent_messages(
+        self, group_id: int, last_seen_id: int
+    ) -> list[tuple[int, str]] | None:
+        """the frames a socket missed after last_seen_id, None if not all in memory"""
+        recent = self.recent.get(group_id)
+        return recent.since(last_seen_id) if recent is not None else None
+
+    def queue_depths(self) -> dict[int, list[int]]:
+        """outbound queue depth of every socket, per user"""
+        return {
+            user_id: [connection.depth for connection in connections]
+            for user_id, connections in self.user_connections.items()
+        }
+
+
+manager = ConnectionManager(broker)
@@ -1,19 +1,43 @@
-from sqlalchemy.orm import Session
-
-from chat import models, schema
-from chat.utils.jwt import get_password_hash
-
-
+import asyncio
+from typing import AsyncIterator
+
+from sqlalchemy import (
+    Delete,
+    Insert,
+    ScalarSelect,
+    Select,
+    Update,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    literal_column,
+    select,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+
+from chat import archive, metrics, models, schema
+from chat.cache import Roster, RosterMember, roster_cache
+from chat.metrics import db_seconds, timed
+from chat.setting import setting
+from chat.utils.jwt import hash_password
+from chat.writer import message_writer
+
+
+@timed(db_seconds)
 async def create_user_controller(
-    db: Session,
+    db: AsyncSession,
     user: schema.CreateUser,
 ) -> models.User | None:
-    existing_user = (
-        db.query(models.User).filter(models.User.username == user.username).first()
+    existing_user = await db.scalar(
+        select(models.User).where(models.User.username == user.username)
     )
     if existing_user:
         return None
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = models.User(
         username=user.username,
         password=hashed_password,
@@ -21,34 +45,41 @@ async def create_user_controller(
         display_name=user.full_name,
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
+@timed(db_seconds)
 async def create_group_controller(
-    db: Session, group: schema.GroupCreate
+    db: AsyncSession, group: schema.GroupCreate
 ) -> models.Group:
     new_group = models.Group(address=group.address, name=group.name)
     db.add(new_group)
-    db.commit()
-    db.refresh(new_group)
+    await db.commit()
+    await db.refresh(new_group)
     return new_group
 
 
+@timed(db_seconds)
 async def create_message_controller(
-    db: Session, user: models.User, group_id: int, text: str
+    db: AsyncSession, user: models.User, group_id: int, text: str
 ) -> models.Message:
-    message = models.Message(
-        text=text, sender_id=user.id, sender_name=user.username, group_id=group_id
-    )
-    db.add(message)
-    db.commit()
+    if setting.MESSAGE_GROUP_COMMIT:
+        message = await message_writer.write(user=user, group_id=group_id, text=text)
+    else:
+        message = models.Message(
+            text=text, sender_id=user.id, sender_name=user.username, group_id=group_id
+        )
+        db.add(message)
+        await db.commit()
+    metrics.messages_ingested.inc()
     return message
 
 
+@timed(db_seconds)
 async def create_unread_message_controller(
-    db: Session,
+    db: AsyncSession,
     user: schema.CreateUser,
     message: models.Message,
     group_id: int,
@@ -60,51 +91,326 @@ async def create_unread_message_controller(
         group_id=group_id,
     )
     db.add(unread_message)
-    db.commit()
+    await db.commit()
     return unread_message
 
 
-async def group_membership_check(
-    group_id: int, db: Session, user: schema.User
-) -> models.GroupMember | None:
+@timed(db_seconds)
+async def create_unread_messages_controller(
+    db: AsyncSession,
+    users: list[models.User] | list[RosterMember],
+    message: models.Message,
+    group_id: int,
+) -> None:
+    """save one unread message per user in a single transaction"""
+    rows = [
+        {
+            "user_id": user.id,
+            "user_name": user.username,
+            "message_id": message.id,
+            "group_id": group_id,
+        }
+        for user in users
+    ]
+    if not rows:
+        return
+    if (
+        db.get_bind().dialect.name == "postgresql"
+        and len(rows) >= setting.UNREAD_COPY_MIN_ROWS
+    ):
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        async with raw_connection.driver_connection.cursor() as cursor:
+            async with cursor.copy(
+                "COPY unread_messages (user_id, user_name, message_id, group_id) "
+                "FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    await copy.write_row(tuple(row.values()))
+    else:
+        await db.execute(insert(models.UnreadMessage), rows)
+    await db.commit()
+
+
+# the message columns clients see; reads that build frames or history
+# pages load only these, anything else raises instead of a query per row
+message_columns = load_only(
+    models.Message.id,
+    models.Message.text,
+    models.Message.sender_name,
+    models.Message.group_id,
+    models.Message.created_at,
+    raiseload=True,
+)
+
+
+def use_watermark() -> bool:
+    return setting.READ_STATE == models.ReadState.watermark
+
+
+def last_read_message_id(user_id: int, group_id: int) -> ScalarSelect:
     return (
-        db.query(models.GroupMember)
-        .filter(
+        select(models.GroupMember.last_read_message_id)
+        .where(
+            models.GroupMember.user_id == user_id,
             models.GroupMember.group_id == group_id,
-            models.GroupMember.user_id == user.id,
         )
-        .first()
+        .scalar_subquery()
     )
 
 
-async def group_members_by_id(
+@timed(db_seconds)
+async def save_read_state(
+    db: AsyncSession,
+    delivered: set[int],
+    message: models.Message,
+    group_id: int,
+    replaying: set[int] = frozenset(),
+) -> None:
+    """
+    record who has read a new message
+    rows: an unread message for every member it wasn't delivered to, the
+    members are read by the insert itself and not from the roster cache,
+    which misses the ones who joined on another node for ROSTER_CACHE_TTL
+    watermark: move the watermark of the members it was delivered to,
+    except the ones still replaying older unread messages of the group,
+    which would be skipped if they don't ack them
+    """
+    if use_watermark():
+        await mark_messages_read(
+            db=db,
+            group_id=group_id,
+            user_ids=delivered - replaying,
+            message_id=message.id,
+        )
+        return
+    await db.execute(unread_rows_statement(group_id, message.id, delivered))
+    await db.commit()
+
+
+def unread_rows_statement(group_id: int, message_id: int, read: set[int]) -> Insert:
+    """an unread message row for every member of the group not in `read`"""
+    columns = ("user_id", "user_name", "message_id", "group_id")
+    members = (
+        select(
+            models.GroupMember.user_id,
+            models.User.username,
+            literal(message_id),
+            literal(group_id),
+        )
+        .join(models.User)
+        .where(
+            models.GroupMember.group_id == group_id,
+            models.GroupMember.user_id.not_in(read),
+        )
+    )
+    return insert(models.UnreadMessage).from_select(columns, members)
+
+
+def mark_read_statement(
+    group_id: int, user_ids: set[int], message_id: int, watermark: bool
+) -> Update | Delete:
+    """
+    watermark: move the members' watermarks up to message_id
+    rows: delete their unread messages up to message_id
+    """
+    if watermark:
+        return (
+            update(models.GroupMember)
+            .where(
+                models.GroupMember.group_id == group_id,
+                models.GroupMember.user_id.in_(user_ids),
+                models.GroupMember.last_read_message_id < message_id,
+            )
+            .values(last_read_message_id=message_id)
+        )
+    return delete(models.UnreadMessage).where(
+        models.UnreadMessage.user_id.in_(user_ids),
+        models.UnreadMessage.group_id == group_id,
+        models.UnreadMessage.message_id <= message_id,
+    )
+
+
+@timed(db_seconds)
+async def mark_messages_read(
+    db: AsyncSession,
     group_id: int,
-    db: Session,
-) -> list[models.User]:
+    user_ids: set[int],
+    message_id: int,
+) -> None:
+    """mark every message of the group up to message_id read for the users"""
+    if not user_ids:
+        return
+    await db.execute(
+        mark_read_statement(group_id, user_ids, message_id, use_watermark())
+    )
+    await db.commit()
+
+
+def unread_messages_query(group_id: int, user_id: int, watermark: bool) -> Select:
+    """the messages of a group the user hasn't read, oldest first"""
+    query = (
+        select(models.Message)
+        .options(message_columns)
+        .where(models.Message.group_id == group_id)
+    )
+    if watermark:
+        query = query.where(
+            models.Message.id > last_read_message_id(user_id, group_id)
+        )
+    else:
+        # the row's group too, so the (user_id, group_id) index is used whole
+        query = query.join(models.UnreadMessage).where(
+            models.UnreadMessage.user_id == user_id,
+            models.UnreadMessage.group_id == group_id,
+        )
+    return query.order_by(models.Message.id)
+
+
+@timed(db_seconds)
+async def get_unread_group_messages(
+    db: AsyncSession,
+    user_id: int,
+    group_id: int,
+) -> list[models.Message]:
+    messages = await db.scalars(
+        unread_messages_query(group_id, user_id, use_watermark())
+    )
+    return list(messages)
+
+
+@timed(db_seconds)
+async def get_unread_messages_by_user(
+    db: AsyncSession,
+    user: schema.User,
+) -> list[dict]:
+    """
+    every unread message of the user, in the shape of UnreadMessage rows
+    (with the watermark the id is the message id)
+    """
+    if use_watermark():
+        unread = await db.execute(
+            select(models.Message.id, models.Message.group_id)
+            .join(
+                models.GroupMember,
+                models.GroupMember.group_id == models.Message.group_id,
+            )
+            .where(
+                models.GroupMember.user_id == user.id,
+                models.Message.id > models.GroupMember.last_read_message_id,
+            )
+            .order_by(models.Message.id)
+        )
+        return [
+            {
+                "id": message_id,
+                "user_id": user.id,
+                "user_name": user.username,
+                "group_id": group_id,
+                "message_id": message_id,
+            }
+            for message_id, group_id in unread
+        ]
+    unread_messages = await db.execute(
+        select(
+            models.UnreadMessage.id,
+            models.UnreadMessage.user_id,
+            models.UnreadMessage.user_name,
+            models.UnreadMessage.group_id,
+            models.UnreadMessage.message_id,
+        ).where(models.UnreadMessage.user_id == user.id)
+    )
+    return [
+        {
+            "id": unread_message.id,
+            "user_id": unread_message.user_id,
+            "user_name": unread_message.user_name,
+            "group_id": unread_message.group_id,
+            "message_id": unread_message.message_id,
+        }
+        for unread_message in unread_messages
+    ]
+
+
+def roster_query(group_id: int) -> Select:
     return (
-        db.query(models.User)
-        .join(models.GroupMember)
-        .filter(models.GroupMember.group_id == group_id)
-        .all()
+        select(
+            models.GroupMember.user_id,
+            models.User.username,
+            models.GroupMember.role,
+        )
+        .join(models.User)
+        .where(models.GroupMember.group_id == group_id)
     )
 
 
+@timed(db_seconds)
+async def get_group_roster(group_id: int, db: AsyncSession) -> Roster:
+    """members of the group, served from the roster cache"""
+    roster = roster_cache.get(group_id)
+    if roster is None:
+        members = await db.execute(roster_query(group_id))
+        roster = {
+            user_id: RosterMember(id=user_id, username=username, role=role)
+            for user_id, username, role in members
+        }
+        roster_cache.set(group_id, roster)
+    return roster
+
+
+def invalidate_roster(group_id: int) -> None:
+    """call after every change to the members of a group"""
+    roster_cache.invalidate(group_id)
+
+
+@timed(db_seconds)
+async def group_membership_check(
+    group_id: int, db: AsyncSession, user: schema.User
+) -> RosterMember | None:
+    member = (await get_group_roster(group_id, db)).get(user.id)
+    age = roster_cache.age(group_id)
+    if member is None and age is not None and age >= setting.ROSTER_RELOAD_AFTER:
+        # the user may have joined on another node since the roster was cached;
+        # not for a fresh roster, or a non-member could keep evicting it
+        invalidate_roster(group_id)
+        member = (await get_group_roster(group_id, db)).get(user.id)
+    return member
+
+
+@timed(db_seconds)
+async def group_members_by_id(
+    group_id: int,
+    db: AsyncSession,
+) -> list[RosterMember]:
+    return list((await get_group_roster(group_id, db)).values())
+
+
+@timed(db_seconds)
 async def get_group_by_id(
     group_id: int,
-    db: Session,
+    db: AsyncSession,
 ) -> models.Group:
-    return db.query(models.Group).filter_by(id=group_id).first()
+    return await db.scalar(select(models.Group).filter_by(id=group_id))
 
 
+@timed(db_seconds)
 async def get_group_by_address(
     address: str,
-    db: Session,
+    db: AsyncSession,
 ) -> models.Group:
-    return db.query(models.Group).filter_by(address=address).first()
+    return await db.scalar(select(models.Group).filter_by(address=address))
 
 
+def newest_message_query(group_id: int) -> Select:
+    """id of the group's newest message, 0 without messages"""
+    return select(func.coalesce(func.max(models.Message.id), 0)).where(
+        models.Message.group_id == group_id
+    )
+
+
+@timed(db_seconds)
 async def join_member_to_group(
-    db: Session,
+    db: AsyncSession,
     user: schema.User,
     group: models.Group,
     role: schema.UserRole = schema.UserRole.member,
@@ -113,84 +419,358 @@ async def join_member_to_group(
         user_id=user.id,
         group_id=group.id,
         role=role,
+        # earlier messages count as read, like with unread message rows
+        last_read_message_id=newest_message_query(group.id).scalar_subquery(),
     )
     db.add(group_member)
-    db.commit()
+    await db.commit()
+    invalidate_roster(group.id)
 
 
+@timed(db_seconds)
 async def get_user_by_id(
     user_id: int,
-    db: Session,
+    db: AsyncSession,
 ) -> models.User:
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
 
 
+@timed(db_seconds)
 async def get_user_groups_by_id(
     user_id: int,
-    db: Session,
+    db: AsyncSession,
 ) -> list[models.Group]:
-    return (
-        db.query(models.Group)
+    groups = await db.scalars(
+        select(models.Group)
         .join(models.GroupMember)
-        .filter(models.GroupMember.user_id == user_id)
-        .all()
+        .where(models.GroupMember.user_id == user_id)
     )
+    return list(groups)
 
 
+@timed(db_seconds)
 async def get_message_by_id(
     message_id: int,
     user_id: int,
-    db: Session,
+    db: AsyncSession,
 ) -> models.Message | None:
-    message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    message = await db.scalar(
+        select(models.Message).where(models.Message.id == message_id)
+    )
     if message and user_id == message.sender_id:
         return message
     return None
 
 
+@timed(db_seconds)
+async def get_group_message(
+    group_id: int,
+    message_id: int,
+    db: AsyncSession,
+) -> models.Message | None:
+    return await db.scalar(
+        select(models.Message)
+        .options(message_columns)
+        .where(
+            models.Message.id == message_id,
+            models.Message.group_id == group_id,
+        )
+    )
+
+
+@timed(db_seconds)
+async def get_group_messages_after(
+    db: AsyncSession,
+    group_id: int,
+    after_id: int,
+    limit: int,
+) -> list[models.Message]:
+    """
+    the group's messages after the message with id `after_id`, oldest
+    first, starting with the archived ones when it is older than them
+    """
+    archived = await get_archived_messages(db, group_id, after_id=after_id, limit=limit)
+    limit = remaining(limit, archived)
+    if limit == 0:
+        return archived
+    messages = await db.scalars(
+        select(models.Message)
+        .options(message_columns)
+        .where(models.Message.group_id == group_id, models.Message.id > after_id)
+        .order_by(models.Message.id)
+        .limit(limit)
+    )
+    return archived + list(messages)
+
+
+def reads_messages_page(
+    group_id: int,
+    user_id: int,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> Select:
+    """ids of a reads_messages_query page, in keyset order"""
+    if use_watermark():
+        read = models.Message.id <= last_read_message_id(user_id, group_id)
+    else:
+        read = ~exists().where(
+            models.UnreadMessage.message_id == models.Message.id,
+            models.UnreadMessage.user_id == user_id,
+        )
+    page = select(models.Message.id).where(models.Message.group_id == group_id, read)
+    if after_id is not None:
+        page = page.where(models.Message.id > after_id).order_by(models.Message.id)
+    else:
+        if before_id is not None:
+            page = page.where(models.Message.id < before_id)
+        page = page.order_by(models.Message.id.desc())
+    return page.limit(limit)
+
+
+def reads_messages_query(
+    group_id: int,
+    user_id: int,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> Select:
+    """
+    keyset page of the messages the user has read in a group, oldest first
+    - after_id: the page right after this message
+    - before_id: the page right before this message
+    - neither: the newest page
+    archived messages are left out, see get_reads_messages
+    """
+    page = reads_messages_page(group_id, user_id, before_id, after_id, limit).subquery()
+    return (
+        select(models.Message)
+        .options(message_columns)
+        .join(page, models.Message.id == page.c.id)
+        .order_by(models.Message.id)
+    )
+
+
+def remaining(limit: int | None, found: list) -> int | None:
+    return None if limit is None else limit - len(found)
+
+
+@timed(db_seconds)
+async def get_archived_messages(
+    db: AsyncSession,
+    group_id: int,
+    after_id: int | None = None,
+    before_id: int | None = None,
+    limit: int | None = None,
+    query: str | None = None,
+) -> list[models.Message]:
+    """
+    messages of the group moved to segment files (see chat.archive), oldest
+    first; they are older than every message left in the table
+    - after_id: the first `limit` after this message, the last ones otherwise
+    - before_id: only the ones before this message
+    - query: only the ones with every word of it
+    """
+    if limit == 0:
+        return []
+    segments = select(models.MessageSegment.name).order_by(
+        models.MessageSegment.first_id
+    )
+    if after_id is not None:
+        segments = segments.where(models.MessageSegment.last_id > after_id)
+    if before_id is not None:
+        segments = segments.where(models.MessageSegment.first_id < before_id)
+    names = list(await db.scalars(segments))
+    if not names:
+        return []
+    return await asyncio.to_thread(
+        archive.read_messages, names, group_id, after_id, before_id, limit, query
+    )
+
+
+@timed(db_seconds)
 async def get_reads_messages(
     group_id: int,
     user: schema.User,
-    db: Session,
+    db: AsyncSession,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
 ) -> list[models.Message] | None:
-    unread_message_ids = [
-        unread_message.message_id for unread_message in user.unread_messages
-    ]
-    messages = (
-        db.query(models.Message)
-        .filter(models.Message.group_id == group_id)
-        .filter(models.Message.id.notin_(unread_message_ids))
-        .order_by(models.Message.id)
-        .all()
+    """
+    a reads_messages_query page, continued into the archived messages
+    (which count as read) where the table has none older left
+    """
+    archived = []
+    if after_id is not None:
+        archived = await get_archived_messages(
+            db, group_id, after_id=after_id, limit=limit
+        )
+        limit = remaining(limit, archived)
+        if limit == 0:
+            return archived
+    messages = list(
+        await db.scalars(
+            reads_messages_query(
+                group_id=group_id,
+                user_id=user.id,
+                before_id=before_id,
+                after_id=after_id,
+                limit=limit,
+            )
+        )
+    )
+    if after_id is None and (limit is None or len(messages) < limit):
+        archived = await get_archived_messages(
+            db,
+            group_id,
+            before_id=messages[0].id if messages else before_id,
+            limit=remaining(limit, messages),
+        )
+    return archived + messages
+
+
+async def stream_reads_messages(
+    group_id: int,
+    user: schema.User,
+    db: AsyncSession,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+) -> AsyncIterator[models.Message]:
+    """same as get_reads_messages, without holding the whole page in memory"""
+    archived = []
+    if after_id is not None:
+        archived = await get_archived_messages(
+            db, group_id, after_id=after_id, limit=limit
+        )
+        limit = remaining(limit, archived)
+    else:
+        # the archived messages go first, so see if the table fills the page
+        page = reads_messages_page(group_id, user.id, before_id, None, limit).subquery()
+        found, oldest = (
+            await db.execute(select(func.count(), func.min(page.c.id)))
+        ).one()
+        if limit is None or found < limit:
+            archived = await get_archived_messages(
+                db,
+                group_id,
+                before_id=oldest or before_id,
+                limit=None if limit is None else limit - found,
+            )
+    for message in archived:
+        yield message
+    if limit == 0:
+        return
+    messages = await db.stream_scalars(
+        reads_messages_query(
+            group_id=group_id,
+            user_id=user.id,
+            before_id=before_id,
+            after_id=after_id,
+            limit=limit,
+        ).execution_options(yield_per=500)
     )
+    async for message in messages:
+        yield message
+
+
+def message_search_query(
+    dialect: str,
+    group_id: int,
+    query: str,
+    before_id: int | None = None,
+    limit: int | None = None,
+) -> Select:
+    """
+    the group's messages with every word of `query`, newest first
+    - before_id: the page right before this message
+    """
+    terms = query.split()
+    search = (
+        select(models.Message)
+        .options(message_columns)
+        .where(models.Message.group_id == group_id)
+    )
+    if dialect == "postgresql":
+        search = search.where(
+            models.message_search_vector.op("@@")(
+                func.plainto_tsquery(
+                    literal_column(f"'{models.SEARCH_CONFIG}'"), " ".join(terms)
+                )
+            )
+        )
+    else:
+        # every term quoted, so FTS5 reads the words and not its query syntax;
+        # a subquery and not a join, which sqlite would run as an FTS lookup
+        # per message of the group
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        search = search.where(
+            models.Message.id.in_(
+                select(models.messages_search.c.rowid).where(
+                    models.messages_search.c.messages_search.op("MATCH")(match)
+                )
+            )
+        )
+    if before_id is not None:
+        search = search.where(models.Message.id < before_id)
+    return search.order_by(models.Message.id.desc()).limit(limit)
+
+
+@timed(db_seconds)
+async def search_group_messages(
+    db: AsyncSession,
+    group_id: int,
+    query: str,
+    before_id: int | None = None,
+    limit: int | None = None,
+) -> list[models.Message]:
+    """
+    the group's messages with every word of `query`, newest first, the
+    archived ones after the table's
+    """
+    if not query.split():
+        return []
+    messages = list(
+        await db.scalars(
+            message_search_query(
+                db.get_bind().dialect.name, group_id, query, before_id, limit
+            )
+        )
+    )
+    if limit is None or len(messages) < limit:
+        archived = await get_archived_messages(
+            db,
+            group_id,
+            before_id=messages[-1].id if messages else before_id,
+            limit=remaining(limit, messages),
+            query=query,
+        )
+        messages.extend(reversed(archived))
     return messages
 
 
+@timed(db_seconds)
 async def get_first_unread_message_group(
     group_id: int,
     user: schema.User,
-    db: Session,
+    db: AsyncSession,
 ) -> models.Message | None:
-    first_unread_message = (
-        db.query(models.Message)
-        .join(models.UnreadMessage)
-        .filter(
-            models.Message.group_id == group_id,
-            models.UnreadMessage.user_id == user.id,
-        )
-        .order_by(models.Message.id)
-        .first()
+    first_unread_message = await db.scalar(
+        unread_messages_query(group_id, user.id, use_watermark()).limit(1)
     )
     return first_unread_message
 
 
+@timed(db_seconds)
 async def create_change_controller(
-    db: Session,
+    db: AsyncSession,
     new_text: str,
     original_text: str,
     changes_type: models.ChangeType,
     sender_id: int,
     group_id: int,
+    message_id: int | None = None,
 ) -> models.Changes:
     change = models.Changes(
         new_text=new_text,
@@ -198,45 +778,82 @@ async def create_change_controller(
         changes_type=changes_type,
         sender_id=sender_id,
         group_id=group_id,
+        message_id=message_id,
     )
     db.add(change)
-    db.commit()
+    await db.commit()
     return change
 
 
+@timed(db_seconds)
 async def get_changes_by_group(
-    db: Session,
+    db: AsyncSession,
     group_id: int,
 ) -> list[models.Changes] | None:
-    change = db.query(models.Changes).filter(models.Changes.group_id == group_id).all()
-    return change
+    change = await db.scalars(
+        select(models.Changes).where(models.Changes.group_id == group_id)
+    )
+    return list(change)
+
+
+def changes_since_query(group_id: int, since: int, limit: int) -> Select:
+    return (
+        select(models.Changes)
+        .where(
+            models.Changes.group_id == group_id,
+            models.Changes.id > since,
+            models.Changes.message_id.is_not(None),
+        )
+        .order_by(models.Changes.id)
+        .limit(limit)
+    )
 
 
+@timed(db_seconds)
+async def get_changes_since(
+    db: AsyncSession,
+    group_id: int,
+    since: int,
+    limit: int,
+) -> list[models.Changes]:
+    """the group's changes after the change with id `since`, oldest first"""
+    changes = await db.scalars(changes_since_query(group_id, since, limit))
+    return list(changes)
+
+
+@timed(db_seconds)
 async def delete_changes_by_group(
-    db: Session,
+    db: AsyncSession,
     group_id: int,
 ) -> None:
-    db.query(models.Changes).filter(models.Changes.group_id == group_id).delete()
+    await db.execute(
+        delete(models.Changes).where(models.Changes.group_id == group_id)
+    )
 
 
+@timed(db_seconds)
 async def edit_message(
-    db: Session,
+    db: AsyncSession,
     changed_message: str,
     message: models.Message,
 ) -> models.Message:
     message.text = changed_message
-    db.commit()
+    await db.commit()
     return message
 
 
+def message_unread_statement(message_id: int) -> Delete:
+    """forget who hasn't read a message, before deleting it"""
+    return delete(models.UnreadMessage).where(
+        models.UnreadMessage.message_id == message_id
+    )
+
+
+@timed(db_seconds)
 async def delete_message(
-    db: Session,
+    db: AsyncSession,
     message: models.Message,
 ) -> None:
-    unread_messages = (
-        db.query(models.UnreadMessage).filter_by(message_id=message.id).first()
-    )
-    if unread_messages:
-        db.delete(unread_messages)
-    db.delete(message)
-    db.commit()
+    await db.execute(message_unread_statement(message.id))
+    await db.execute(delete(models.Message).where(models.Message.id == message.id))
+    await db.commit()
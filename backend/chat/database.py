@@ -1,18 +1,40 @@
+from typing import AsyncIterator
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from chat.setting import setting
+
+
+def get_async_url(url: str) -> str:
+    """
+    Return the async driver variant of a database url.
 
-engine = create_engine(
-    "postgresql+psycopg://root:1234@db/postgres"
-)  # TODO: Change it to async!
+    psycopg serves both engines with the same url, sqlite needs aiosqlite.
+    """
+    database_url = make_url(url)
+    if database_url.drivername == "sqlite":
+        database_url = database_url.set(drivername="sqlite+aiosqlite")
+    return database_url.render_as_string(hide_password=False)
+
+
+# sync engine, kept for scripts and schema management
+engine = create_engine(setting.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(get_async_url(setting.DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,241 @@
+"""
+Maintenance commands, run from the backend folder:
+
+    python -m chat.manage migrate
+    python -m chat.manage explain
+    python -m chat.manage backfill-watermarks [--delete-rows]
+    python -m chat.manage compact-changes
+    python -m chat.manage archive-messages [--older-than DAYS]
+"""
+import argparse
+import re
+import sys
+
+from sqlalchemy import Connection, Executable, delete, func, select, text, update
+
+from chat import models
+from chat.archive import archive_messages
+from chat.crud import (
+    changes_since_query,
+    mark_read_statement,
+    message_search_query,
+    message_unread_statement,
+    newest_message_query,
+    reads_messages_query,
+    roster_query,
+    unread_messages_query,
+    unread_rows_statement,
+)
+from chat.database import SessionLocal, engine
+from chat.migrations import current_version, migrate
+from chat.setting import setting
+
+
+def run_migrations() -> None:
+    applied = migrate(engine)
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if applied:
+        print(f"Applied migrations {', '.join(map(str, applied))}")
+    print(f"Schema is at version {version}")
+
+
+def hot_queries(dialect: str) -> dict[str, Executable]:
+    """
+    the queries the chat runs for every message, read and join, built by
+    the same functions crud uses
+    """
+    group_id, user_id, message_id = 1, 1, 1
+    return {
+        # get_group_roster, behind group_membership_check and broadcasts
+        "roster": roster_query(group_id),
+        # get_unread_group_messages, get_first_unread_message_group
+        "unread of a member": unread_messages_query(group_id, user_id, False),
+        "unread after watermark": unread_messages_query(group_id, user_id, True),
+        # save_read_state (rows)
+        "unread rows": unread_rows_statement(group_id, message_id, {user_id}),
+        # mark_messages_read
+        "mark read": mark_read_statement(group_id, {user_id}, message_id, False),
+        "move watermark": mark_read_statement(group_id, {user_id}, message_id, True),
+        # delete_message
+        "unread of a message": message_unread_statement(message_id),
+        # get_reads_messages, newest page and an older one
+        "history": reads_messages_query(group_id, user_id, None, None, 100),
+        "history before": reads_messages_query(group_id, user_id, 1000, None, 100),
+        # get_changes_since
+        "changes since": changes_since_query(group_id, message_id, 100),
+        # search_group_messages
+        "search": message_search_query(dialect, group_id, "hello world", None, 50),
+        # join_member_to_group
+        "newest message": newest_message_query(group_id),
+    }
+
+
+def query_plans(connection: Connection) -> dict[str, tuple[list[str], list[str]]]:
+    """
+    the plan of every hot query, and the tables it reads whole
+
+    postgres prefers sequential scans on small tables, so they are turned off
+    to see whether an index could serve the query at all.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        prefix, full_scan = "EXPLAIN QUERY PLAN ", re.compile(r"^SCAN (\w+)$")
+    else:
+        prefix, full_scan = "EXPLAIN ", re.compile(r"Seq Scan on (\w+)")
+        connection.execute(text("SET enable_seqscan = off"))
+    plans = {}
+    for name, query in hot_queries(dialect).items():
+        statement = query.compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+        rows = connection.execute(text(prefix + str(statement)))
+        plan = [str(row[-1]) for row in rows]
+        # sqlite scans the subqueries it materialized, those are small
+        materialized = set(re.findall(r"MATERIALIZE (\w+)", "\n".join(plan)))
+        scans = [
+            match.group(1)
+            for match in map(full_scan.search, (line.strip() for line in plan))
+            if match and match.group(1) not in materialized
+        ]
+        plans[name] = (plan, scans)
+    return plans
+
+
+def explain() -> None:
+    """print the plan of every hot query and fail if one reads a whole table"""
+    scans = []
+    with engine.connect() as connection:
+        for name, (plan, tables) in query_plans(connection).items():
+            print(f"-- {name}")
+            for line in plan:
+                print(f"   {line}")
+            scans += [f"{name}: full scan of {table}" for table in tables]
+    if scans:
+        print("\n".join(scans), file=sys.stderr)
+        sys.exit(1)
+    print("Every hot query uses an index")
+
+
+def backfill_watermarks(delete_rows: bool = False) -> None:
+    """
+    Move read state from UnreadMessage rows to GroupMember.last_read_message_id
+
+    The watermark becomes the message before the member's oldest unread one,
+    or the group's newest message when nothing is unread. Read messages that
+    come after an unread one are counted as unread from then on.
+    """
+    # the column comes with the migrations
+    migrate(engine)
+    with SessionLocal() as db:
+        first_unread = (
+            select(func.min(models.UnreadMessage.message_id) - 1)
+            .where(
+                models.UnreadMessage.user_id == models.GroupMember.user_id,
+                models.UnreadMessage.group_id == models.GroupMember.group_id,
+            )
+            .scalar_subquery()
+        )
+        newest = (
+            select(func.max(models.Message.id))
+            .where(models.Message.group_id == models.GroupMember.group_id)
+            .scalar_subquery()
+        )
+        result = db.execute(
+            update(models.GroupMember).values(
+                last_read_message_id=func.coalesce(first_unread, newest, 0)
+            )
+        )
+        print(f"Backfilled {result.rowcount} group members")
+        if delete_rows:
+            result = db.execute(delete(models.UnreadMessage))
+            print(f"Deleted {result.rowcount} unread messages")
+        db.commit()
+
+
+def compact_changes() -> None:
+    """
+    Keep only the newest change of every message
+
+    A later edit replaces the text of an earlier one and a delete makes
+    them all moot, so clients of /group/{group_id}/changes only need the
+    last one. Keeping the newest row keeps every client's `since` valid.
+    """
+    newest = (
+        select(func.max(models.Changes.id))
+        .where(models.Changes.message_id.is_not(None))
+        .group_by(models.Changes.message_id)
+    )
+    with SessionLocal() as db:
+        result = db.execute(
+            delete(models.Changes).where(
+                models.Changes.message_id.is_not(None),
+                models.Changes.id.not_in(newest),
+            )
+        )
+        db.commit()
+    print(f"Deleted {result.rowcount} superseded changes")
+
+
+def archive(older_than_days: int) -> None:
+    """
+    Move the months of messages older than `older_than_days` to segment
+    files, see chat.archive
+    """
+    # the segment catalog comes with the migrations
+    migrate(engine)
+    segments = archive_messages(older_than_days)
+    for segment in segments:
+        print(
+            f"Archived {segment['messages']} messages"
+            f" ({segment['first_created_at']:%Y-%m-%d} to"
+            f" {segment['last_created_at']:%Y-%m-%d}) to {segment['name']}"
+        )
+    if not segments:
+        print("Nothing to archive")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m chat.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create or upgrade the database schema")
+    commands.add_parser(
+        "explain", help="check that the hot queries are served by indexes"
+    )
+    backfill = commands.add_parser(
+        "backfill-watermarks",
+        help="fill last_read_message_id from unread messages (READ_STATE=watermark)",
+    )
+    backfill.add_argument(
+        "--delete-rows",
+        action="store_true",
+        help="delete the unread messages once they are moved",
+    )
+    commands.add_parser(
+        "compact-changes", help="drop edits superseded by a later change"
+    )
+    archive_parser = commands.add_parser(
+        "archive-messages", help="move old messages to compressed segment files"
+    )
+    archive_parser.add_argument(
+        "--older-than",
+        type=int,
+        default=setting.ARCHIVE_AFTER_DAYS,
+        metavar="DAYS",
+        help="archive the months that ended this many days ago",
+    )
+    args = parser.parse_args()
+    if args.command == "migrate":
+        run_migrations()
+    elif args.command == "explain":
+        explain()
+    elif args.command == "backfill-watermarks":
+        backfill_watermarks(delete_rows=args.delete_rows)
+    elif args.command == "compact-changes":
+        compact_changes()
+    elif args.command == "archive-messages":
+        archive(older_than_days=args.older_than)
+
+
+if __name__ == "__main__":
+    main()
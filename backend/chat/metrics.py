@@ -0,0 +1,235 @@
+"""
+In-process metrics in the Prometheus text format, served on /metrics
+
+Counters, gauges and histograms are plain dicts of floats keyed by label
+values, updated inline on the hot paths; nothing is sent anywhere until
+Prometheus scrapes. Metrics that mirror state kept elsewhere (sockets,
+queues, caches) are read from a callback at scrape time instead.
+"""
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable
+
+# label values -> value, () for metrics without labels
+Samples = dict[tuple[str, ...], float]
+
+# seconds, from a quick query or a local send to a stuck event loop
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+registry: list["Metric"] = []
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def key(self, labels: dict) -> tuple[str, ...]:
+        if not self.labelnames:
+            return ()
+        return tuple([labels[name] for name in self.labelnames])
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """(name suffix, formatted labels, value) lines of the metric"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {value!r}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    a value that only goes up, counted inline or read from `collect` at
+    scrape time (label values -> value, or a bare value without labels)
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        collect: Callable[[], Samples | float] | None = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        # without labels the metric is scraped, at zero, before its first use
+        self.values: Samples = {} if self.labelnames else {(): 0}
+        self.collect = collect
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        values = self.values
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [
+            ("", format_labels(self.labelnames, key), float(value))
+            for key, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    """a value that goes up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self.key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # label values -> [count per bucket..., count over the last, sum]
+        self.values: dict[tuple[str, ...], list[float]] = {}
+        if not self.labelnames:
+            self.values[()] = self.zeros()
+
+    def zeros(self) -> list[float]:
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = self.zeros()
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                bucket = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    ("_bucket", format_labels(names, key + (bucket,)), float(total))
+                )
+            labels = format_labels(self.labelnames, key)
+            lines.append(("_sum", labels, float(counts[-1])))
+            lines.append(("_count", labels, float(total)))
+        return lines
+
+
+def render() -> str:
+    """every registered metric in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+connections = Gauge(
+    "chat_connections",
+    "Open sockets per websocket endpoint",
+    ("endpoint",),
+)
+messages_ingested = Counter(
+    "chat_messages_ingested_total",
+    "Messages stored from clients",
+)
+messages_delivered = Counter(
+    "chat_messages_delivered_total",
+    "Message frames queued for the users subscribed to their group",
+)
+broadcast_seconds = Histogram(
+    "chat_broadcast_seconds",
+    "Time to broadcast a message or a change on this node",
+    ("function",),
+)
+send_latency_seconds = Histogram(
+    "chat_send_latency_seconds",
+    "Time from queueing a frame on a socket to sending it",
+)
+db_seconds = Histogram(
+    "chat_db_seconds",
+    "Time spent in database functions of chat.crud",
+    ("function",),
+)
+loop_lag_seconds = Histogram(
+    "chat_event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task",
+)
+
+
+def timed(histogram: Histogram) -> Callable:
+    """record how long an async function takes, labelled with its name"""
+
+    def decorator(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, function=name)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_loop_lag(interval: float) -> None:
+    """sleep for `interval` over and over, and record how late each wake-up is"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
@@ -0,0 +1,265 @@
+"""
+Versioned schema migrations
+
+Each migration runs once, in version order, in its own transaction, and is
+recorded in the schema_version table. Migrations check the schema before
+changing it, so they apply both to fresh databases and to databases that
+were created with create_all before migrations existed.
+
+Run them with `python -m chat.manage migrate`.
+"""
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Connection,
+    DateTime,
+    Engine,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.schema import CreateColumn
+
+from chat import logger, models
+
+Migration = Callable[[Connection], None]
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow, nullable=False),
+)
+
+MIGRATIONS: list[tuple[int, str, Migration]] = []
+
+
+def migration(version: int, name: str) -> Callable[[Migration], Migration]:
+    def register(upgrade: Migration) -> Migration:
+        MIGRATIONS.append((version, name, upgrade))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return upgrade
+
+    return register
+
+
+def add_column(connection: Connection, column: Column) -> None:
+    """add a model column to its table if it isn't there yet"""
+    columns = inspect(connection).get_columns(column.table.name)
+    if column.name not in {existing["name"] for existing in columns}:
+        definition = CreateColumn(column).compile(dialect=connection.dialect)
+        connection.execute(
+            text(f"ALTER TABLE {column.table.name} ADD COLUMN {definition}")
+        )
+
+
+def create_index(connection: Connection, table: Table, name: str) -> None:
+    """create an index declared on a model if it isn't there yet"""
+    index: Index = next(index for index in table.indexes if index.name == name)
+    index.create(connection, checkfirst=True)
+
+
+# the tables as they were before migrations existed, later migrations bring
+# them up to the models; don't change these, add a migration instead
+initial_tables = MetaData()
+user_role = Enum("admin", "member", name="userrole")
+Table(
+    "users",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("password", String),
+    Column("display_name", String),
+    Column("email", String, unique=True, index=True),
+    Column("role", user_role, nullable=False),
+    Column("bio", String),
+    Column("disabled", Boolean),
+    Column("profile_pic", String),
+)
+Table(
+    "groups",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("address", String, unique=True, index=True, nullable=False),
+    Column("name", String, nullable=False),
+)
+Table(
+    "group_members",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("group_id", Integer, ForeignKey("groups.id"), nullable=False),
+    Column("role", user_role, nullable=False),
+)
+Table(
+    "messages",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("text", String),
+    Column("created_at", DateTime),
+    Column("sender_id", Integer, ForeignKey("users.id")),
+    Column("sender_name", String),
+    Column("group_id", Integer, ForeignKey("groups.id")),
+)
+Table(
+    "unread_messages",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("user_name", String),
+    Column("message_id", Integer, ForeignKey("messages.id"), nullable=False),
+    Column("group_id", Integer, ForeignKey("groups.id"), nullable=False),
+)
+Table(
+    "changes",
+    initial_tables,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("new_text", String),
+    Column("original_text", String),
+    Column("changes_type", Enum("Edit", "Delete", name="changetype"), nullable=False),
+    Column("created_at", DateTime),
+    Column("sender_id", Integer, ForeignKey("users.id")),
+    Column("group_id", Integer, ForeignKey("groups.id")),
+)
+
+
+@migration(1, "initial schema")
+def initial_schema(connection: Connection) -> None:
+    initial_tables.create_all(connection)
+
+
+@migration(2, "group member read watermark")
+def read_watermark(connection: Connection) -> None:
+    add_column(connection, models.GroupMember.__table__.c.last_read_message_id)
+
+
+@migration(3, "hot path indexes")
+def hot_path_indexes(connection: Connection) -> None:
+    create_index(connection, models.Message.__table__, "ix_messages_group_id_id")
+    create_index(
+        connection,
+        models.UnreadMessage.__table__,
+        "ix_unread_messages_user_id_group_id",
+    )
+    create_index(
+        connection, models.UnreadMessage.__table__, "ix_unread_messages_message_id"
+    )
+    # a member can only join a group once, drop duplicates left by races
+    first_membership = select(func.min(models.GroupMember.id)).group_by(
+        models.GroupMember.group_id, models.GroupMember.user_id
+    )
+    connection.execute(
+        delete(models.GroupMember).where(
+            models.GroupMember.id.not_in(first_membership)
+        )
+    )
+    create_index(
+        connection,
+        models.GroupMember.__table__,
+        "uq_group_members_group_id_user_id",
+    )
+
+
+@migration(4, "changes message id")
+def changes_message_id(connection: Connection) -> None:
+    add_column(connection, models.Changes.__table__.c.message_id)
+    create_index(connection, models.Changes.__table__, "ix_changes_group_id_id")
+
+
+@migration(5, "message search")
+def message_search(connection: Connection) -> None:
+    """
+    full-text index of messages.text, kept current by the database itself
+    - postgresql: a generated tsvector column with a GIN index
+    - sqlite: an FTS5 table over messages, with triggers and a rebuild
+    """
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        columns = inspect(connection).get_columns("messages")
+        if "search" not in {column["name"] for column in columns}:
+            connection.execute(
+                text(
+                    "ALTER TABLE messages ADD COLUMN search tsvector GENERATED ALWAYS"
+                    f" AS (to_tsvector('{models.SEARCH_CONFIG}', coalesce(text, '')))"
+                    " STORED"
+                )
+            )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_messages_search"
+                " ON messages USING gin (search)"
+            )
+        )
+    elif dialect == "sqlite":
+        for statement in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_search"
+            " USING fts5(text, content='messages', content_rowid='id')",
+            "CREATE TRIGGER IF NOT EXISTS messages_search_insert"
+            " AFTER INSERT ON messages BEGIN"
+            " INSERT INTO messages_search (rowid, text) VALUES (new.id, new.text);"
+            " END",
+            "CREATE TRIGGER IF NOT EXISTS messages_search_delete"
+            " AFTER DELETE ON messages BEGIN"
+            " INSERT INTO messages_search (messages_search, rowid, text)"
+            " VALUES ('delete', old.id, old.text);"
+            " END",
+            "CREATE TRIGGER IF NOT EXISTS messages_search_update"
+            " AFTER UPDATE OF text ON messages BEGIN"
+            " INSERT INTO messages_search (messages_search, rowid, text)"
+            " VALUES ('delete', old.id, old.text);"
+            " INSERT INTO messages_search (rowid, text) VALUES (new.id, new.text);"
+            " END",
+            "INSERT INTO messages_search (messages_search) VALUES ('rebuild')",
+        ):
+            connection.execute(text(statement))
+    else:
+        logger.warning("No message search index for %s", dialect)
+
+
+@migration(6, "message segments")
+def message_segments(connection: Connection) -> None:
+    models.MessageSegment.__table__.create(connection, checkfirst=True)
+
+
+def current_version(connection: Connection) -> int:
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+    return connection.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def migrate(engine: Engine) -> list[int]:
+    """
+    apply every pending migration
+
+    output:
+    - versions that were applied
+    """
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        applied = set(connection.scalars(select(schema_version.c.version)))
+    done = []
+    for version, name, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(
+                insert(schema_version).values(version=version, name=name)
+            )
+        logger.info("Applied migration %s: %s", version, name)
+        done.append(version)
+    return done
@@ -6,8 +6,12 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
+    column,
+    literal_column,
+    table,
 )
 from sqlalchemy import (
     Enum as SQLAlchemyEnum,
@@ -27,6 +31,13 @@ class ChangeType(str, Enum):
     Delete = "Delete"
 
 
+class ReadState(str, Enum):
+    # one UnreadMessage row per member and message
+    rows = "rows"
+    # GroupMember.last_read_message_id, everything after it is unread
+    watermark = "watermark"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -39,10 +50,9 @@ class User(Base):
     bio = Column(String, default="")
     disabled = Column(Boolean, default=False)
     profile_pic = Column(String, default="")
-    groups = relationship("GroupMember", back_populates="user")
-    messages = relationship("Message", back_populates="sender")
-    unread_messages = relationship("UnreadMessage", back_populates="user")
-    websocket = None
+    groups = relationship("GroupMember", back_populates="user", lazy="raise")
+    messages = relationship("Message", back_populates="sender", lazy="raise")
+    unread_messages = relationship("UnreadMessage", back_populates="user", lazy="raise")
 
 
 class UnreadMessage(Base):
@@ -54,8 +64,13 @@ class UnreadMessage(Base):
     message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
 
-    user = relationship("User", back_populates="unread_messages")
-    message = relationship("Message", back_populates="unread_for")
+    user = relationship("User", back_populates="unread_messages", lazy="raise")
+    message = relationship("Message", back_populates="unread_for", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_unread_messages_user_id_group_id", "user_id", "group_id"),
+        Index("ix_unread_messages_message_id", "message_id"),
+    )
 
 
 class Group(Base):
@@ -64,8 +79,8 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     address = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=False)
-    members = relationship("GroupMember", back_populates="group")
-    messages = relationship("Message", back_populates="group")
+    members = relationship("GroupMember", back_populates="group", lazy="raise")
+    messages = relationship("Message", back_populates="group", lazy="raise")
 
 
 class GroupMember(Base):
@@ -75,9 +90,16 @@ class GroupMember(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
     role = Column(SQLAlchemyEnum(UserRole), default=UserRole.member, nullable=False)
+    last_read_message_id = Column(Integer, default=0, server_default="0", nullable=False)
 
-    user = relationship("User", back_populates="groups")
-    group = relationship("Group", back_populates="members")
+    user = relationship("User", back_populates="groups", lazy="raise")
+    group = relationship("Group", back_populates="members", lazy="raise")
+
+    __table_args__ = (
+        Index(
+            "uq_group_members_group_id_user_id", "group_id", "user_id", unique=True
+        ),
+    )
 
 
 class Message(Base):
@@ -90,9 +112,19 @@ class Message(Base):
     sender_name = Column(String)
     group_id = Column(Integer, ForeignKey("groups.id"))
 
-    sender = relationship("User", back_populates="messages")
-    group = relationship("Group", back_populates="messages")
-    unread_for = relationship("UnreadMessage", back_populates="message")
+    sender = relationship("User", back_populates="messages", lazy="raise")
+    group = relationship("Group", back_populates="messages", lazy="raise")
+    unread_for = relationship("UnreadMessage", back_populates="message", lazy="raise")
+
+    __table_args__ = (Index("ix_messages_group_id_id", "group_id", "id"),)
+
+
+# full-text search of messages.text, created by migration 5 and kept current
+# by the database: a generated tsvector column with a GIN index on postgres,
+# an FTS5 table over messages on sqlite; neither is mapped
+SEARCH_CONFIG = "simple"
+message_search_vector = literal_column("messages.search")
+messages_search = table("messages_search", column("rowid"), column("messages_search"))
 
 
 class Changes(Base):
@@ -108,3 +140,26 @@ class Changes(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     sender_id = Column(Integer, ForeignKey("users.id"))
     group_id = Column(Integer, ForeignKey("groups.id"))
+    # not a foreign key, the message is gone once it is deleted
+    message_id = Column(Integer)
+
+    __table_args__ = (Index("ix_changes_group_id_id", "group_id", "id"),)
+
+
+class MessageSegment(Base):
+    """
+    a partition of old messages moved out of the messages table into a
+    segment file, see chat.archive
+    """
+
+    __tablename__ = "message_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # file name in ARCHIVE_DIR, without the extensions
+    name = Column(String, unique=True, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    first_created_at = Column(DateTime, nullable=False)
+    last_created_at = Column(DateTime, nullable=False)
+    messages = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
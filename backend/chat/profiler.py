@@ -0,0 +1,162 @@
+"""
+SQL profiler and N+1 detector
+
+Off unless SQL_PROFILE is set. Every HTTP request and every socket event
+(a /ws operation, a /send-message message, an unread replay, a broker
+delivery) then gets a QueryProfile: the statements it ran, the time spent
+in them and how often each statement shape (fingerprint) repeated. A
+handler over SQL_QUERY_BUDGET statements, or running one shape
+SQL_REPEAT_LIMIT times or more (a query per row, the N+1 pattern), is
+logged with SQL_PROFILE=warn and fails with SQL_PROFILE=raise.
+
+Scripts and tests can check a block of code directly:
+
+    with query_budget(3, "broadcast"):
+        await broadcast_message(group_id, message, db)
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from fastapi import Request
+from sqlalchemy import event
+
+from chat import app, logger
+from chat.database import async_engine, engine
+from chat.setting import setting
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAMETER = re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s")
+PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """a handler ran more statements than its budget, or the same one per row"""
+
+
+def fingerprint(statement: str) -> str:
+    """the shape of a statement: literals, parameters and IN lists made ?"""
+    statement = STRING.sub("?", statement)
+    statement = PARAMETER.sub("?", statement)
+    statement = NUMBER.sub("?", statement)
+    statement = PARAMETER_LIST.sub("(?)", statement)
+    return SPACE.sub(" ", statement).strip()
+
+
+class QueryProfile:
+    """statements run in one handler; nested profiles add to their parents"""
+
+    def __init__(
+        self,
+        name: str,
+        budget: int | None,
+        parent: "QueryProfile | None" = None,
+    ):
+        self.name = name
+        self.budget = budget
+        self.parent = parent
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        shape = fingerprint(statement)
+        profile = self
+        while profile is not None:
+            profile.queries += 1
+            profile.seconds += seconds
+            profile.statements[shape] += 1
+            profile = profile.parent
+
+    def repeated(self) -> list[tuple[str, int]]:
+        return [
+            (shape, count)
+            for shape, count in self.statements.most_common()
+            if count >= setting.SQL_REPEAT_LIMIT
+        ]
+
+    def over_budget(self) -> bool:
+        return (
+            self.budget is not None and self.queries > self.budget
+        ) or bool(self.repeated())
+
+    def report(self) -> str:
+        lines = [
+            f"{self.name}: {self.queries} queries in {self.seconds * 1000:.1f} ms"
+            f" (budget {self.budget})"
+        ]
+        for shape, count in self.repeated():
+            lines.append(f"  {count}x {shape}")
+        return "\n".join(lines)
+
+
+current_profile: ContextVar[QueryProfile | None] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is not None:
+        started = conn.info["profile_started"].pop()
+        profile.record(statement, time.perf_counter() - started)
+
+
+def install() -> None:
+    """listen to both engines, once"""
+    for sync_engine in (async_engine.sync_engine, engine):
+        if event.contains(sync_engine, "before_cursor_execute", before_cursor_execute):
+            continue
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def profile_queries(
+    name: str,
+    budget: int | None = setting.SQL_QUERY_BUDGET,
+    mode: str | None = None,
+) -> Iterator[QueryProfile | None]:
+    """
+    profile the statements run inside the block
+    - mode: warn or raise when the block goes over budget, SQL_PROFILE by
+      default; nothing is recorded when it is empty
+    """
+    mode = setting.SQL_PROFILE if mode is None else mode
+    if not mode:
+        yield None
+        return
+    install()
+    profile = QueryProfile(name, budget, current_profile.get())
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+    if profile.over_budget():
+        if mode == "raise":
+            raise QueryBudgetExceeded(profile.report())
+        logger.warning("Query budget exceeded %s", profile.report())
+
+
+def query_budget(budget: int, name: str = "block"):
+    """fail the block if it runs more than `budget` statements or an N+1"""
+    return profile_queries(name, budget, mode="raise")
+
+
+if setting.SQL_PROFILE:
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        with profile_queries(f"{request.method} {request.url.path}"):
+            return await call_next(request)
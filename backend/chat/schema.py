@@ -2,7 +2,7 @@ from datetime import datetime
 
 from pydantic import BaseModel
 
-from chat.models import UserRole
+from chat.models import ChangeType, UserRole
 
 
 class Token(BaseModel):
@@ -13,13 +13,14 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: str | None = None
     id: int | None = None
+    exp: int | None = None
 
 
 class User(BaseModel):
     id: int | None = None  # may create some bug check it later TODO
     username: str
     password: str
-    display_name: str
+    display_name: str | None = None
     email: str | None = None
     role: UserRole
     bio: str | None = None
@@ -51,5 +52,30 @@ class GroupMessageResponse(BaseModel):
     message_text: str
 
 
+class GroupChangeResponse(BaseModel):
+    id: int
+    message_id: int
+    type: ChangeType
+    new_text: str | None = None
+    time: datetime
+
+
+class GroupChangesResponse(BaseModel):
+    group_id: int
+    changes: list[GroupChangeResponse]
+    # pass as `since` for the next page, more pages follow while has_more
+    since: int
+    has_more: bool
+
+
+class GroupSearchResponse(BaseModel):
+    group_id: int
+    q: str
+    messages: list[GroupMessageResponse]
+    # pass as `before_id` for the next page, more pages follow while has_more
+    before_id: int | None
+    has_more: bool
+
+
 class GetGroupMessagesResponse(BaseModel):
     messages: list[GroupMessageResponse]
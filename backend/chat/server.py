@@ -0,0 +1,96 @@
+"""
+Run the app with uvicorn and tuned permessage-deflate, from the backend folder:
+
+    python -m chat.server --host 0.0.0.0 --port 8000
+
+uvicorn offers permessage-deflate with websockets' defaults: every message
+is compressed, however small, with a 32 KB window per socket. Here the
+window and memory level are smaller (WS_DEFLATE_WINDOW_BITS,
+WS_DEFLATE_MEM_LEVEL) and messages under WS_DEFLATE_THRESHOLD bytes are
+sent as they are, where compressing costs more CPU than it saves bytes.
+"""
+import argparse
+
+import uvicorn
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import OP_BINARY, OP_TEXT, Frame
+
+from chat.setting import setting
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that leaves messages under `threshold` bytes alone"""
+
+    def __init__(self, *args, threshold: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def encode(self, frame: Frame) -> Frame:
+        # RFC 7692 lets every message choose, uncompressed ones have no rsv1
+        # and don't touch the compression context
+        if (
+            frame.opcode in (OP_TEXT, OP_BINARY)
+            and frame.fin
+            and len(frame.data) < self.threshold
+        ):
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, threshold: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            threshold=self.threshold,
+        )
+
+
+def deflate_factory() -> ThresholdPerMessageDeflateFactory:
+    return ThresholdPerMessageDeflateFactory(
+        threshold=setting.WS_DEFLATE_THRESHOLD,
+        server_max_window_bits=setting.WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"memLevel": setting.WS_DEFLATE_MEM_LEVEL},
+    )
+
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """uvicorn's websockets protocol, offering the tuned permessage-deflate"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [deflate_factory()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m chat.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args()
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        reload=args.reload,
+        ws=ChatWebSocketProtocol,
+    )
+
+
+if __name__ == "__main__":
+    main()
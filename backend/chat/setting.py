@@ -1,3 +1,4 @@
+import os
 from enum import auto
 
 
@@ -6,6 +7,86 @@ class Settings(auto):
     SECRET_KEY: str = "SeCretKey_CHaNgeMe"
     ALGORITHM: str = "HS256"
     VERSION: int = 1
+    DATABASE_URL: str = os.getenv(
+        "DATABASE_URL", "postgresql+psycopg://root:1234@db/postgres"
+    )
+    # memory:// for a single node, postgresql:// or redis:// to fan out across nodes
+    BROKER_URL: str = os.getenv("BROKER_URL", "memory://")
+    # rows or watermark, see chat.models.ReadState; switch to watermark
+    # after running `python -m chat.manage backfill-watermarks`
+    READ_STATE: str = os.getenv("READ_STATE", "rows")
+    # frames buffered per socket before OUTBOUND_OVERFLOW_POLICY kicks in,
+    # one of drop_oldest, coalesce or disconnect (see chat.connection)
+    OUTBOUND_QUEUE_SIZE: int = 1024
+    OUTBOUND_OVERFLOW_POLICY: str = "coalesce"
+    # /group/{group_id}/messages page sizes, bigger pages are streamed
+    HISTORY_PAGE_SIZE: int = 100
+    HISTORY_PAGE_MAX: int = 10000
+    HISTORY_STREAM_MIN_ROWS: int = 1000
+    # /group/{group_id}/changes page sizes
+    CHANGES_PAGE_SIZE: int = 500
+    CHANGES_PAGE_MAX: int = 5000
+    # /group/{group_id}/search page sizes
+    SEARCH_PAGE_SIZE: int = 50
+    SEARCH_PAGE_MAX: int = 500
+    # `python -m chat.manage archive-messages` moves messages older than
+    # ARCHIVE_AFTER_DAYS, a month at a time, to segment files in ARCHIVE_DIR
+    # (see chat.archive); history and search decompress ARCHIVE_BLOCK_ROWS
+    # of them at a time, and keep the indexes of ARCHIVE_INDEX_CACHE_SIZE
+    # segments in memory
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    ARCHIVE_BLOCK_ROWS: int = 1000
+    ARCHIVE_INDEX_CACHE_SIZE: int = 256
+    # fan-out batches at least this big are written with COPY on postgres
+    UNREAD_COPY_MIN_ROWS: int = 100
+    # group rosters kept in memory, and for how many seconds another node's
+    # join can go unnoticed
+    ROSTER_CACHE_SIZE: int = 10000
+    ROSTER_CACHE_TTL: float = 60
+    # a lookup of someone who isn't in the cached roster reloads it, unless
+    # it was loaded less than this many seconds ago
+    ROSTER_RELOAD_AFTER: float = 1
+    # verified tokens kept in memory with their user, so reconnects don't
+    # query users; a change made on another node shows after the TTL
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: float = 60
+    # store incoming messages in group commits: wait up to WINDOW_MS for
+    # more messages, or MAX_ROWS of them, and insert them in one transaction
+    MESSAGE_GROUP_COMMIT: bool = os.getenv("MESSAGE_GROUP_COMMIT", "") == "1"
+    GROUP_COMMIT_WINDOW_MS: float = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+    GROUP_COMMIT_MAX_ROWS: int = 256
+    # unread messages are replayed in Batch frames of at most this many
+    # messages (clients may ask for less) and about this many bytes
+    REPLAY_BATCH_SIZE: int = 256
+    REPLAY_BATCH_BYTES: int = 64 * 1024
+    # frames of the last messages of each subscribed group kept in memory,
+    # so a socket resuming from last_seen_id gets its gap without a query;
+    # bigger gaps are read from the database, up to RESUME_MAX_MESSAGES
+    RECENT_MESSAGES_SIZE: int = 1000
+    RESUME_MAX_MESSAGES: int = 5000
+    # permessage-deflate of `python -m chat.server`: messages under the
+    # threshold (bytes) go uncompressed, 2**WINDOW_BITS bytes of history
+    WS_DEFLATE_THRESHOLD: int = 64
+    WS_DEFLATE_WINDOW_BITS: int = 12
+    WS_DEFLATE_MEM_LEVEL: int = 5
+    # encoded message frames kept for replays, edits and deletes drop them
+    FRAME_CACHE_SIZE: int = 10000
+    FRAME_CACHE_TTL: float = 300
+    # bcrypt cost of new hashes, older hashes are upgraded on login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    # hashes computed at once off the event loop, and callers allowed to
+    # wait for one before logins get a 503
+    BCRYPT_WORKERS: int = int(os.getenv("BCRYPT_WORKERS", "2"))
+    BCRYPT_MAX_WAITING: int = 256
+    # opt-in SQL profiling of every HTTP request and socket event (see
+    # chat.profiler): "warn" logs and "raise" fails a handler that runs more
+    # than SQL_QUERY_BUDGET statements, or one statement SQL_REPEAT_LIMIT times
+    SQL_PROFILE: str = os.getenv("SQL_PROFILE", "")
+    SQL_QUERY_BUDGET: int = int(os.getenv("SQL_QUERY_BUDGET", "10"))
+    SQL_REPEAT_LIMIT: int = 5
+    # seconds between the event loop lag probes of /metrics
+    METRICS_LOOP_LAG_INTERVAL: float = 0.5
 
 
 setting = Settings()
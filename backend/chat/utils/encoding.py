@@ -0,0 +1,63 @@
+"""
+JSON used on the wire: socket frames, broker events and REST responses
+
+orjson is used when it is installed and the standard library otherwise,
+both produce the same compact JSON. Sockets that negotiated the msgpack
+subprotocol get the MessagePack encoding of the same frames.
+"""
+import json
+from functools import cached_property
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+def dumps(value: Any) -> str:
+    if orjson is not None:
+        # int keys become strings, like the json module does
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, separators=(",", ":"))
+
+
+def loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        # orjson only reads exact str, not Frame
+        return orjson.loads(str(data) if isinstance(data, Frame) else data)
+    return json.loads(data)
+
+
+class Frame(str):
+    """
+    A socket frame encoded as JSON
+
+    Its MessagePack encoding is made the first time a binary socket needs it
+    and is then shared by every socket the frame goes to, like the text.
+    """
+
+    @cached_property
+    def packed(self) -> bytes:
+        # orjson only takes exact str
+        return msgpack.packb(loads(self))
+
+
+def encode_frame(value: Any) -> Frame:
+    return Frame(dumps(value))
+
+
+def packed(frame: str) -> bytes:
+    """MessagePack encoding of a JSON frame"""
+    if not isinstance(frame, Frame):
+        frame = Frame(frame)
+    return frame.packed
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data)
@@ -39,3 +39,23 @@ class NotFoundException(HTTPException):
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Not Found",
         )
+
+
+class ServiceUnavailableException(HTTPException):
+    """SERVICE_UNAVAILABLE 503"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too Many Requests, Try Again Later",
+        )
+
+
+class BadRequestException(HTTPException):
+    """BAD_REQUEST 400"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bad Request",
+        )
@@ -1,21 +1,23 @@
+import time
 from datetime import datetime, timedelta
 from typing import Annotated
 
 import bcrypt
 from chat import models
-from chat.database import get_db, engine, Base
+from chat.cache import principal_cache
+from chat.database import get_db
 from chat.schema import TokenData, User
 from chat.setting import setting
 from chat.utils.exception import CredentialsException
+from chat.utils.password import password_pool
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-Base.metadata.create_all(bind=engine)
-
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -43,46 +45,74 @@ def get_password_hash(password: str) -> str:
         password: The plain text password to hash.
 
     Returns:
-        The generated password hash.
+        The generated password hash, with a cost of BCRYPT_ROUNDS.
     """
-    hashed_bytes = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    hashed_bytes = bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(setting.BCRYPT_ROUNDS)
+    )
     return hashed_bytes.decode("utf-8")
 
 
-def get_user(user_db: Session, username: str) -> models.User:
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Checks if a stored hash was made with a cost other than BCRYPT_ROUNDS.
+
+    Args:
+        hashed_password: The stored hashed password ($2b$<cost>$...).
+
+    Returns:
+        True if the password should be hashed again, False otherwise.
+    """
+    return int(hashed_password.split("$")[2]) != setting.BCRYPT_ROUNDS
+
+
+async def hash_password(password: str) -> str:
+    """get_password_hash on the password pool, off the event loop"""
+    return await password_pool.run(get_password_hash, password)
+
+
+async def get_user(user_db: AsyncSession, username: str) -> models.User:
     """
     Retrieve a user from the database based on the username.
 
     Args:
-        user_db (Session): The database session.
+        user_db (AsyncSession): The database session.
         username (str): The username of the user to retrieve.
 
     Returns:
         Optional[models.User]: The user object if found, None otherwise.
     """
-    user = user_db.query(models.User).filter(models.User.username == username).first()
+    user = await user_db.scalar(
+        select(models.User).where(models.User.username == username)
+    )
     return user
 
 
-def authenticate_user(
-    user_db: Session, username: str, password: str
+async def authenticate_user(
+    user_db: AsyncSession, username: str, password: str
 ) -> models.User | None:
     """
     Authenticate a user based on the provided username and password.
+    The password is checked on the password pool, and hashed again when
+    its cost is not BCRYPT_ROUNDS anymore.
 
     Args:
-        user_db (Session): The database session.
+        user_db (AsyncSession): The database session.
         username (str): The username of the user to authenticate.
         password (str): The password of the user to authenticate.
 
     Returns:
         Optional[models.User]: The authenticated user object if successful, None otherwise.
     """
-    user = get_user(user_db, username)
+    user = await get_user(user_db, username)
     if not user:
         return None
-    if not verify_password(password, user.password):
+    if not await password_pool.run(verify_password, password, user.password):
         return None
+    if password_needs_rehash(user.password):
+        user.password = await hash_password(password)
+        await user_db.commit()
+        invalidate_principal(user.id)
     return user
 
 
@@ -114,7 +144,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
 
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    user_db: Session = Depends(
+    user_db: AsyncSession = Depends(
         get_db,
     ),
 ) -> User:
@@ -123,16 +153,36 @@ async def get_current_user(
 
     Args:
         token (str): The JWT token representing the user.
-        user_db (Session, optional): The database session. Defaults to Depends(get_db).
+        user_db (AsyncSession, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        models.User: The current authenticated user.
+        User: A snapshot of the current authenticated user, verified tokens
+        are cached (see invalidate_principal).
     """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     token_data = decode_jwt(token)
-    user = get_user(user_db, username=token_data.username)
+    user = await get_user(user_db, username=token_data.username)
     if user is None:
         raise CredentialsException
-    return user
+    principal = User.model_validate(user, from_attributes=True)
+    # never serve a token from the cache after it expired
+    principal_cache.set(token, principal, ttl=token_data.exp - time.time())
+    return principal
+
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Drop the cached tokens of a user.
+
+    Call it after every change to a user (disabling, renaming, ...) so that
+    requests stop seeing the old snapshot.
+
+    Args:
+        user_id (int): The id of the changed user.
+    """
+    principal_cache.invalidate_where(lambda user: user.id == user_id)
 
 
 async def get_current_active_user(
@@ -198,7 +248,7 @@ def decode_jwt(
         user_id: int = int(payload.get("id"))
         if username is None or user_id is None:
             raise CredentialsException
-        token_data = TokenData(username=username, id=user_id)
+        token_data = TokenData(username=username, id=user_id, exp=payload.get("exp"))
     except JWTError:
         raise CredentialsException
     return token_data
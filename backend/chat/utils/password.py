@@ -0,0 +1,76 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from chat.setting import setting
+from chat.utils.exception import ServiceUnavailableException
+
+Result = TypeVar("Result")
+
+
+class PasswordPool:
+    """
+    Runs bcrypt off the event loop
+
+    bcrypt releases the GIL while it hashes, so a thread pool of `workers`
+    threads is enough to keep sockets responsive during logins. At most
+    `workers` hashes run at once. Callers wait for a free worker, and once
+    `max_waiting` are waiting new ones are turned away with a 503 instead
+    of piling up.
+    """
+
+    def __init__(self, workers: int, max_waiting: int):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+        self.slots = asyncio.Semaphore(workers)
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, function: Callable[..., Result], *args) -> Result:
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServiceUnavailableException
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        waited = started - queued
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, *args
+            )
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.run_seconds += time.perf_counter() - started
+            self.slots.release()
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+            "run_seconds": self.run_seconds,
+        }
+
+
+password_pool = PasswordPool(
+    workers=setting.BCRYPT_WORKERS, max_waiting=setting.BCRYPT_MAX_WAITING
+)
@@ -3,3 +3,4 @@ from .websocket import *
 from .groups import *
 from .user import *
 from .messages import *
+from .metrics import *
@@ -3,9 +3,10 @@ from typing import Annotated
 
 from fastapi import Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from chat import app
+from chat.cache import principal_cache, roster_cache
 from chat.database import get_db
 from chat.schema import Token
 from chat.setting import setting
@@ -16,6 +17,7 @@ from chat.utils.jwt import (
     authenticate_user,
     create_access_token,
 )
+from chat.utils.password import password_pool
 
 
 @app.get("/health")
@@ -24,10 +26,22 @@ async def health_check():
     return status.HTTP_200_OK
 
 
+@app.get("/health/caches")
+async def cache_stats():
+    """Size and hit/miss counters of the in-process caches"""
+    return {"roster": roster_cache.stats(), "principal": principal_cache.stats()}
+
+
+@app.get("/health/password-pool")
+async def password_pool_stats():
+    """Load of the bcrypt workers, and how long logins wait for them"""
+    return password_pool.stats()
+
+
 @app.post("/token", response_model=Token)
 async def create_jwt_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    user_db: Session = Depends(get_db),
+    user_db: AsyncSession = Depends(get_db),
 ):
     """
     Create token for user
@@ -38,7 +52,7 @@ async def create_jwt_token(
     - access_token
     - token_type
     """
-    user = authenticate_user(
+    user = await authenticate_user(
         user_db,
         form_data.username,
         form_data.password,
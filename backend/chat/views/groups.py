@@ -1,20 +1,27 @@
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 
-from fastapi import Depends
-from sqlalchemy.orm import Session
+from fastapi import Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from chat import app, models, schema
 from chat.crud import (
     create_group_controller,
+    get_changes_since,
     get_group_by_address,
     get_reads_messages,
     group_members_by_id,
     group_membership_check,
     join_member_to_group,
+    search_group_messages,
+    stream_reads_messages,
 )
-from chat.database import get_db
+from chat.database import AsyncSessionLocal, get_db
+from chat.setting import setting
+from chat.utils.encoding import dumps
 from chat.utils.exception import (
     AlreadyExistsException,
+    BadRequestException,
     ForbiddenException,
     NotFoundException,
 )
@@ -28,7 +35,7 @@ async def create_group(
     address: str,
     name: str,
     current_user: schema.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Create Group
@@ -66,7 +73,7 @@ async def create_group(
 )
 async def get_group_members(
     group_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schema.User = Depends(get_current_active_user),
 ):
     """
@@ -100,7 +107,7 @@ async def get_group_members(
 @app.post("/group/join", response_model=bool, tags=["Groups"])
 async def join_group(
     address: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schema.User = Depends(get_current_active_user),
 ):
     """
@@ -131,11 +138,20 @@ async def join_group(
 async def get_group_messages(
     group_id: int,
     current_user: Annotated[schema.User, Depends(get_current_active_user)],
-    db: Session = Depends(get_db),
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: Annotated[
+        int, Query(ge=1, le=setting.HISTORY_PAGE_MAX)
+    ] = setting.HISTORY_PAGE_SIZE,
+    db: AsyncSession = Depends(get_db),
 ):
     """
-    Get Group reads messages
+    Get Group reads messages, one page at a time (oldest first)
     - group_id [int]
+    - before_id [int] the page before this message, for scrolling back
+    - after_id [int] the page after this message, for catching up,
+      not together with before_id
+    - limit [int] page size, without a cursor the newest page is returned
 
     output:
     - username [str]
@@ -143,6 +159,8 @@ async def get_group_messages(
     - time [str]
     - message_text [str]
     """
+    if before_id is not None and after_id is not None:
+        raise BadRequestException
     group = await group_membership_check(
         group_id=group_id,
         user=current_user,
@@ -150,19 +168,154 @@ async def get_group_messages(
     )
     if not group:
         raise NotFoundException  # TODO: raise errors better like if group exists but if user is not user of that group raise another error
-    messages = await get_reads_messages(
+    page = {
+        "group_id": group_id,
+        "user": current_user,
+        "before_id": before_id,
+        "after_id": after_id,
+        "limit": limit,
+    }
+    if limit >= setting.HISTORY_STREAM_MIN_ROWS:
+        return StreamingResponse(
+            stream_messages_page(page), media_type="application/json"
+        )
+    messages = await get_reads_messages(db=db, **page)
+    return [history_payload(message) for message in messages or []]
+
+
+@app.get(
+    "/group/{group_id}/changes",
+    tags=["Groups"],
+    response_model=schema.GroupChangesResponse,
+)
+async def get_group_changes(
+    group_id: int,
+    current_user: Annotated[schema.User, Depends(get_current_active_user)],
+    since: int = 0,
+    limit: Annotated[
+        int, Query(ge=1, le=setting.CHANGES_PAGE_MAX)
+    ] = setting.CHANGES_PAGE_SIZE,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Get the edits and deletes of a group after a change, oldest first
+    - group_id [int]
+    - since [int] id of the last change the client has, 0 for all of them
+      (Edit and Delete socket frames carry it as change_id)
+    - limit [int] page size
+
+    output:
+    - GroupChangesResponse
+        - group_id: int
+        - changes: list of id, message_id, type, new_text, time
+        - since: int, pass it back to get the next page
+        - has_more: bool
+    """
+    group = await group_membership_check(
+        group_id=group_id,
         user=current_user,
+        db=db,
+    )
+    if not group:
+        raise NotFoundException
+    changes = await get_changes_since(
+        db=db, group_id=group_id, since=since, limit=limit + 1
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return schema.GroupChangesResponse(
+        group_id=group_id,
+        changes=[
+            schema.GroupChangeResponse(
+                id=change.id,
+                message_id=change.message_id,
+                type=change.changes_type,
+                new_text=change.new_text,
+                time=change.created_at,
+            )
+            for change in changes
+        ],
+        since=changes[-1].id if changes else since,
+        has_more=has_more,
+    )
+
+
+@app.get(
+    "/group/{group_id}/search",
+    tags=["Groups"],
+    response_model=schema.GroupSearchResponse,
+)
+async def search_group(
+    group_id: int,
+    q: Annotated[str, Query(min_length=1, max_length=256)],
+    current_user: Annotated[schema.User, Depends(get_current_active_user)],
+    before_id: int | None = None,
+    limit: Annotated[
+        int, Query(ge=1, le=setting.SEARCH_PAGE_MAX)
+    ] = setting.SEARCH_PAGE_SIZE,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Search the messages of a group, newest first
+    - group_id [int]
+    - q [str] the messages with every word of it
+    - before_id [int] the page before this message
+    - limit [int] page size
+
+    output:
+    - GroupSearchResponse
+        - group_id: int
+        - q: str
+        - messages: list of username, message_id, time, message_text
+        - before_id: int, pass it back to get the next page
+        - has_more: bool
+    """
+    group = await group_membership_check(
         group_id=group_id,
+        user=current_user,
         db=db,
     )
-    if messages:
-        messages_data = [
-            {
-                "username": message.sender_name,
-                "message_id": message.id,
-                "datetime": str(message.created_at),
-                "message_text": message.text,
-            }
+    if not group:
+        raise NotFoundException
+    messages = await search_group_messages(
+        db=db, group_id=group_id, query=q, before_id=before_id, limit=limit + 1
+    )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    return schema.GroupSearchResponse(
+        group_id=group_id,
+        q=q,
+        messages=[
+            schema.GroupMessageResponse(
+                username=message.sender_name,
+                message_id=message.id,
+                time=message.created_at,
+                message_text=message.text,
+            )
             for message in messages
-        ]
-        return messages_data
+        ],
+        before_id=messages[-1].id if messages else before_id,
+        has_more=has_more,
+    )
+
+
+def history_payload(message: models.Message) -> dict:
+    return {
+        "username": message.sender_name,
+        "message_id": message.id,
+        "datetime": str(message.created_at),
+        "message_text": message.text,
+    }
+
+
+async def stream_messages_page(page: dict) -> AsyncIterator[str]:
+    """
+    write a page as a json array while it is read from the database
+    the request session is closed before the body is sent, so use our own
+    """
+    separator = "["
+    async with AsyncSessionLocal() as db:
+        async for message in stream_reads_messages(db=db, **page):
+            yield separator + dumps(history_payload(message))
+            separator = ","
+    yield "[]" if separator == "[" else "]"
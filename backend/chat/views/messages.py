@@ -1,13 +1,9 @@
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from chat import app, models
 from chat.crud import (
-    create_change_controller,
-    delete_message,
-    edit_message,
     get_first_unread_message_group,
-    get_message_by_id,
     group_membership_check,
 )
 from chat.database import get_db
@@ -18,14 +14,14 @@ from chat.utils.exception import (
 from chat.utils.jwt import (
     get_current_active_user,
 )
-from chat.views.websocket import broadcast_changes
+from chat.views.websocket import change_message
 
 
 @app.get("/message/{group_id}/first-unread-message", tags=["Messages"])
 async def get_first_unread_message(
     group_id: int,
     current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> int | None:
     """
     Send first unread message id
@@ -52,7 +48,7 @@ async def edit_message_by_id(
     message_id: int,
     changed_message: str,
     current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> str | None:
     """
     Edit text of the message by message id
@@ -62,32 +58,14 @@ async def edit_message_by_id(
     output:
     - changed message [str]
     """
-    message = await get_message_by_id(
+    message = await change_message(
         db=db,
+        user=current_user,
         message_id=message_id,
-        user_id=current_user.id,
+        change_type=models.ChangeType.Edit,
+        new_text=changed_message,
     )
     if message:
-        await create_change_controller(
-            db=db,
-            new_text=changed_message,
-            original_text=message.text,
-            group_id=message.group_id,
-            sender_id=current_user.id,
-            changes_type=models.ChangeType.Edit,
-        )
-        message = await edit_message(
-            db=db,
-            message=message,
-            changed_message=changed_message,
-        )
-        await broadcast_changes(
-            db=db,
-            group_id=message.group_id,
-            change_type=models.ChangeType.Edit,
-            message_id=message_id,
-            new_text=changed_message,
-        )
         return message.text
     raise ForbiddenException
 
@@ -96,7 +74,7 @@ async def edit_message_by_id(
 async def delete_message_by_id(
     message_id: int,
     current_user: models.User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> str | None:
     """
     Delete text of the message by message id
@@ -105,27 +83,12 @@ async def delete_message_by_id(
     output:
     - deleted message text [str]
     """
-    message = await get_message_by_id(
+    message = await change_message(
         db=db,
+        user=current_user,
         message_id=message_id,
-        user_id=current_user.id,
+        change_type=models.ChangeType.Delete,
     )
     if message:
-        await create_change_controller(
-            db=db,
-            new_text="",
-            original_text=message.text,
-            group_id=message.group_id,
-            sender_id=current_user.id,
-            changes_type=models.ChangeType.Delete,
-        )
-        await broadcast_changes(
-            db=db,
-            group_id=message.group_id,
-            change_type=models.ChangeType.Delete,
-            message_id=message_id,
-            new_text="",
-        )
-        await delete_message(db=db, message=message)
         return message.text
     raise ForbiddenException
@@ -0,0 +1,97 @@
+import asyncio
+
+from fastapi.responses import PlainTextResponse
+
+from chat import app
+from chat.cache import frame_cache, principal_cache, roster_cache
+from chat.connection import manager
+from chat.metrics import Counter, Gauge, Samples, monitor_loop_lag, render
+from chat.setting import setting
+from chat.utils.password import password_pool
+from chat.writer import message_writer
+
+CACHES = {"roster": roster_cache, "principal": principal_cache, "frame": frame_cache}
+
+
+def cache_stat(name: str) -> Samples:
+    return {(cache,): instance.stats()[name] for cache, instance in CACHES.items()}
+
+
+def queue_depths() -> list[int]:
+    return [
+        depth for depths in manager.queue_depths().values() for depth in depths
+    ]
+
+
+Gauge(
+    "chat_group_subscribers",
+    "Sockets subscribed to a group on this node",
+    ("group_id",),
+    collect=lambda: {
+        (str(group_id),): len(subscribers)
+        for group_id, subscribers in manager.group_subscribers.items()
+    },
+)
+Gauge(
+    "chat_outbound_queue_depth",
+    "Frames waiting in the outbound queues of all sockets",
+    collect=lambda: sum(queue_depths()),
+)
+Gauge(
+    "chat_outbound_queue_depth_max",
+    "Frames waiting in the fullest outbound queue",
+    collect=lambda: max(queue_depths(), default=0),
+)
+Gauge(
+    "chat_cache_size",
+    "Entries in the in-process caches",
+    ("cache",),
+    collect=lambda: cache_stat("size"),
+)
+Counter(
+    "chat_cache_hits_total",
+    "Cache lookups that found a live entry",
+    ("cache",),
+    collect=lambda: cache_stat("hits"),
+)
+Counter(
+    "chat_cache_misses_total",
+    "Cache lookups that didn't",
+    ("cache",),
+    collect=lambda: cache_stat("misses"),
+)
+Gauge(
+    "chat_password_pool_waiting",
+    "Password hashes waiting for a bcrypt worker",
+    collect=lambda: password_pool.stats()["waiting"],
+)
+Counter(
+    "chat_password_pool_rejected_total",
+    "Logins turned away because too many were waiting",
+    collect=lambda: password_pool.stats()["rejected"],
+)
+Gauge(
+    "chat_message_writer_pending",
+    "Messages waiting for the next group commit",
+    collect=lambda: message_writer.stats()["pending"],
+)
+
+
+@app.on_event("startup")
+async def start_loop_lag_monitor() -> None:
+    app.state.loop_lag_monitor = asyncio.create_task(
+        monitor_loop_lag(setting.METRICS_LOOP_LAG_INTERVAL)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_loop_lag_monitor() -> None:
+    app.state.loop_lag_monitor.cancel()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Metrics of this node in the Prometheus text format"""
+    return PlainTextResponse(
+        render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,11 +1,12 @@
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from chat import app
 from chat.crud import (
     create_user_controller,
+    get_unread_messages_by_user,
     get_user_groups_by_id,
 )
 from chat.database import get_db
@@ -41,7 +42,8 @@ async def read_users_me(
 
 @app.get("/user/unread_messages", tags=["User"])
 async def unread_messages(
-    current_user: Annotated[User, Depends(get_current_active_user)]
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Send unread messages detail
@@ -53,11 +55,11 @@ async def unread_messages(
     - group_id [int]
     - message_id [int]
     """
-    return current_user.unread_messages
+    return await get_unread_messages_by_user(db=db, user=current_user)
 
 
 @app.post("/user/create", response_model=User, tags=["User"])
-async def create_user(user: CreateUser, db: Session = Depends(get_db)):
+async def create_user(user: CreateUser, db: AsyncSession = Depends(get_db)):
     """
     Create User
     - username [str]
@@ -84,7 +86,7 @@ async def create_user(user: CreateUser, db: Session = Depends(get_db)):
 
 @app.get("/user/groups", tags=["User"])
 async def get_user_groups(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
     """
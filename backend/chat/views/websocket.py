@@ -1,27 +1,55 @@
 import asyncio
-import json
+from typing import Iterable, Iterator
 
 from fastapi import Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from chat import app, logger, models
+from chat import app, logger, metrics, models
+from chat.broker import broker
+from chat.cache import frame_cache
+from chat.connection import Connection, manager
 from chat.crud import (
+    create_change_controller,
     create_message_controller,
-    create_unread_message_controller,
-    get_group_by_id,
+    delete_message,
+    edit_message,
+    get_group_message,
+    get_group_messages_after,
+    get_message_by_id,
+    get_unread_group_messages,
+    group_members_by_id,
     group_membership_check,
+    mark_messages_read,
+    save_read_state,
 )
-from chat.database import get_db
-from chat.models import Message, User
+from chat.database import AsyncSessionLocal, get_db
+from chat.metrics import broadcast_seconds, timed
+from chat.models import Message
+from chat.profiler import profile_queries
+from chat.setting import setting
+from chat.utils.encoding import Frame, encode_frame, loads, msgpack
+from chat.utils.exception import CredentialsException
 from chat.utils.jwt import get_current_user
+from chat.writer import message_writer
 
-websocket_connections = {}
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+@app.on_event("startup")
+async def start_broker() -> None:
+    await broker.start(deliver_event)
+
+
+@app.on_event("shutdown")
+async def stop_broker() -> None:
+    await message_writer.stop()
+    await broker.stop()
 
 
 @app.websocket("/send-message")
 async def send_messages_endpoint(
     websocket: WebSocket,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> None:
     """
     User send message api
@@ -59,59 +87,70 @@ async def send_messages_endpoint(
             user.username,
             group_id,
         )
-        user.websocket = websocket
         await websocket.accept()
-        while True:
-            try:
-                data = await websocket.receive_text()
-            except WebSocketDisconnect as error_message:
-                logger.info(
-                    "User %s Disconnect from Send Messages endpoint group id : %s, %s",
-                    user.username,
-                    group_id,
-                    error_message,
-                )
-                break
-            if data is None:
-                break
-            message = await create_message_controller(
-                db=db, user=user, group_id=group_id, text=data
-            )
-            # Broadcast the message to all users in the group
-            asyncio.create_task(broadcast_message(group_id, message, db))
+        metrics.connections.inc(endpoint="/send-message")
+        try:
+            while True:
+                try:
+                    data = await websocket.receive_text()
+                except WebSocketDisconnect as error_message:
+                    logger.info(
+                        "User %s Disconnect from Send Messages endpoint group id : %s, %s",
+                        user.username,
+                        group_id,
+                        error_message,
+                    )
+                    break
+                if data is None:
+                    break
+                with profile_queries("ws /send-message"):
+                    message = await create_message_controller(
+                        db=db, user=user, group_id=group_id, text=data
+                    )
+                    # Broadcast the message to all users in the group
+                    await broadcast_message(group_id, message, db)
+        finally:
+            metrics.connections.dec(endpoint="/send-message")
 
 
+@timed(broadcast_seconds)
 async def broadcast_message(group_id: int, message: Message, db) -> None:
     """
-    send message to online users and save unread message for other users
+    push message to online users and save the read state of every member
+    users online on other nodes get it through the broker, and the node
+    that delivered it marks it read for them
     - group_id [int]
     - message [Message]
 
     output:
     - None
     """
-    group = await get_group_by_id(db=db, group_id=group_id)
-    if group:
-        for member in group.members:
-            await create_unread_message_controller(
-                db=db,
-                message=message,
-                user=member.user,
-                group_id=group_id,
-            )
-            if member.user.websocket:
-                asyncio.create_task(member.user.websocket.send_text(message.text))
+    members = await group_members_by_id(db=db, group_id=group_id)
+    if members:
+        frame = message_frame(message)
+        delivered = manager.publish(group_id, frame, message.id)
+        await save_read_state(
+            db=db,
+            delivered=delivered,
+            message=message,
+            group_id=group_id,
+            replaying=manager.replaying(group_id),
+        )
+        await publish_event(
+            group_id, {"type": "message", "message_id": message.id}, frame
+        )
 
 
 @app.websocket("/get-unread-messages")
 async def send_unread_messages_endpoint(
     websocket: WebSocket,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> None:
     """
     Send unread messages
     - token [str]
     - group_id [int]
+    - max_batch [int] optional, most messages per Batch frame
 
     [in websocket]
     - message
@@ -123,9 +162,13 @@ async def send_unread_messages_endpoint(
     group_id = websocket.query_params.get("group_id")
     if token and group_id:
         user = await get_current_user(user_db=db, token=token)
-        group_id = int(group_id)
     else:
         return await websocket.close(reason="You're not allowed", code=4403)
+    try:
+        group_id = int(group_id)
+        max_batch = int(websocket.query_params.get("max_batch", 0))
+    except ValueError:
+        return await websocket.close(reason="Invalid query parameters", code=1008)
     is_group_member = await group_membership_check(
         group_id=group_id,
         db=db,
@@ -134,126 +177,592 @@ async def send_unread_messages_endpoint(
     if not is_group_member:
         return await websocket.close(reason="You're not allowed", code=4403)
     if user:
-        if user.id in websocket_connections:
-            logger.error(
-                "User %s Has More Than 1 Websocket With Group id : %s",
-                user.username,
-                group_id,
-            )
-            return await websocket.close(reason="You're not allowed", code=4403)
-        websocket_connections[user.id] = websocket
-        await websocket.accept()
+        subprotocol = negotiate_subprotocol(websocket)
+        connection = Connection(websocket, user.id, binary=subprotocol is not None)
+        manager.connect(connection)
+        connection.begin_replay(group_id)
+        await manager.subscribe(connection, group_id)
+        await websocket.accept(subprotocol=subprotocol)
+        metrics.connections.inc(endpoint="/get-unread-messages")
         try:
-            await send_unread_messages(websocket, user, group_id, db)
+            await send_unread_messages(connection, group_id, db, max_batch)
         except (WebSocketDisconnect, RuntimeError):
             pass
+        finally:
+            metrics.connections.dec(endpoint="/get-unread-messages")
+            await manager.disconnect(connection)
     else:
         return await websocket.close()
 
 
 async def send_unread_messages(
-    websocket: WebSocket,
-    user: User,
+    connection: Connection,
     group_id: int,
-    db: Session = Depends(get_db),
-):
-    """send unread messages to client"""
+    db: AsyncSession,
+    max_batch: int = 0,
+) -> None:
+    """
+    send stored unread messages once, then push new ones as they are broadcast
+    the database is only read here on connect, live messages come from the
+    queue; the ones broadcast while the unread messages are read are held
+    back until they are sent (see Connection.begin_replay)
+    """
+    websocket = connection.websocket
+    last_id = None
+    try:
+        with profile_queries("ws /get-unread-messages"):
+            unread_messages = await get_unread_group_messages(
+                db=db, user_id=connection.user_id, group_id=group_id
+            )
+            if unread_messages:
+                # the writer isn't running yet, nothing can go out before these
+                frames = message_frames(unread_messages)
+                for frame, _, last_id in batch_frames(group_id, frames, max_batch):
+                    await connection.send(frame)
+                await mark_messages_read(
+                    db=db,
+                    group_id=group_id,
+                    user_ids={connection.user_id},
+                    message_id=last_id,
+                )
+    finally:
+        connection.end_replay(group_id, last_id)
+    await run_until_first_done(
+        wait_for_disconnect(websocket),
+        connection.write(),
+    )
+
+
+async def wait_for_disconnect(websocket: WebSocket) -> None:
+    """read from the socket until the client goes away"""
     while True:
-        db.refresh(user)
-        all_unread_messages: models.UnreadMessage = user.unread_messages
-        unread_messages_group: list[models.UnreadMessage] = []
-        if all_unread_messages:
-            unread_messages_group = [
-                un_mes
-                for un_mes in all_unread_messages
-                if str(un_mes.group_id) == str(group_id)
-            ]
-            await send_messages_concurrently(websocket, unread_messages_group)
-            for message in all_unread_messages:
-                db.delete(message)
-            db.commit()
-        else:
-            try:
-                await asyncio.wait_for(websocket.receive(), timeout=0.7)
-                continue
-            except asyncio.TimeoutError:
+        event = await websocket.receive()
+        if event["type"] == "websocket.disconnect":
+            return
+
+
+async def run_until_first_done(*coroutines) -> None:
+    """run the coroutines together until one returns or fails, cancel the rest"""
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+    for task in done:
+        error = task.exception()
+        if error and not isinstance(error, (WebSocketDisconnect, RuntimeError)):
+            raise error
+
+
+@app.websocket("/ws")
+async def multiplexed_endpoint(
+    websocket: WebSocket,
+    db: AsyncSession = Depends(get_db),
+) -> None:
+    """
+    One socket per user for all of their groups
+    - token [str]
+
+    [in websocket] json frames, each one names its group
+    - {"op": "subscribe", "group_id": 1, "max_batch": 100, "last_seen_id": 9},
+      max_batch and last_seen_id are optional
+    - {"op": "unsubscribe", "group_id": 1}
+    - {"op": "send", "group_id": 1, "text": "hi"}
+    - {"op": "edit", "group_id": 1, "message_id": 2, "text": "hi!"}
+    - {"op": "delete", "group_id": 1, "message_id": 2}
+    - {"op": "ack", "group_id": 1, "message_id": 2}
+
+    [out websocket]
+    - message and change frames of the subscribed groups, with their group_id
+    - {"type": "Batch", "group_id": 1, "messages": [...]}, replayed messages,
+      oldest first: the ones after last_seen_id when given, unread otherwise
+    - {"type": "Resync", "group_id": 1, "after_id": 9}, the gap was too big to
+      replay, the rest is in /group/{group_id}/messages
+    - {"type": "Error", "group_id": 1, "detail": "..."}
+
+    output:
+     - None
+    """
+    token = websocket.query_params.get("token")
+    try:
+        user = await get_current_user(user_db=db, token=token) if token else None
+    except CredentialsException:
+        user = None
+    if not user:
+        return await websocket.close(reason="You're not allowed", code=4403)
+    logger.info("User %s Connect to multiplexed endpoint", user.username)
+    subprotocol = negotiate_subprotocol(websocket)
+    connection = Connection(websocket, user.id, binary=subprotocol is not None)
+    manager.connect(connection)
+    await websocket.accept(subprotocol=subprotocol)
+    metrics.connections.inc(endpoint="/ws")
+    try:
+        await run_until_first_done(
+            read_frames(connection, user, db),
+            connection.write(),
+        )
+    finally:
+        metrics.connections.dec(endpoint="/ws")
+        await manager.disconnect(connection)
+        logger.info("User %s Disconnect from multiplexed endpoint", user.username)
+
+
+def negotiate_subprotocol(websocket: WebSocket) -> str | None:
+    """
+    "msgpack" when the client offers it (Sec-WebSocket-Protocol) and the
+    server can speak it, frames are then MessagePack binary messages both
+    ways; None keeps JSON text frames
+    """
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get(
+        "subprotocols", ()
+    ):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+async def read_frames(
+    connection: Connection,
+    user: models.User,
+    db: AsyncSession,
+) -> None:
+    """read client frames and run them, membership is checked once per group"""
+    allowed_groups: set[int] = set()
+    while True:
+        try:
+            frame = await connection.receive()
+            operation = FRAME_OPERATIONS[frame["op"]]
+            group_id = int(frame["group_id"])
+        except (ValueError, KeyError, TypeError):
+            connection.push(error_frame(None, "Invalid frame"))
+            continue
+        if group_id not in allowed_groups:
+            if not await group_membership_check(group_id=group_id, db=db, user=user):
+                connection.push(error_frame(group_id, "You're not allowed"))
                 continue
-            except (WebSocketDisconnect, RuntimeError):
-                if websocket_connections[user.id]:
-                    websocket_connections.pop(user.id)
-                break
+            allowed_groups.add(group_id)
+        try:
+            with profile_queries(f"ws {frame['op']}"):
+                await operation(connection, user, group_id, frame, db)
+        except (ValueError, KeyError, TypeError):
+            connection.push(error_frame(group_id, "Invalid frame"))
+
+
+async def subscribe_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    """
+    start receiving a group
+    a client that was connected before sends the last message id it saw and
+    gets exactly the messages after it, nothing is written for that; others
+    get their unread messages, replayed until acked. Live messages of the
+    group wait until the replay is queued, so they come after it.
+    """
+    if group_id in connection.groups:
+        return
+    max_batch = int(frame.get("max_batch", 0))
+    last_seen_id = frame.get("last_seen_id")
+    if last_seen_id is not None:
+        last_seen_id = int(last_seen_id)
+    last_id = None
+    connection.begin_replay(group_id)
+    try:
+        await manager.subscribe(connection, group_id)
+        if last_seen_id is not None:
+            last_id = await resume_messages(
+                connection, group_id, last_seen_id, max_batch, db
+            )
+        else:
+            unread_messages = await get_unread_group_messages(
+                db=db, user_id=user.id, group_id=group_id
+            )
+            last_id = await replay_messages(
+                connection, group_id, unread_messages, max_batch
+            )
+        if last_id is not None and last_id != last_seen_id:
+            # live messages don't mark the group read until this is acked
+            connection.unacked[group_id] = last_id
+    finally:
+        connection.end_replay(group_id, last_id)
+
+
+async def resume_messages(
+    connection: Connection,
+    group_id: int,
+    last_seen_id: int,
+    max_batch: int,
+    db: AsyncSession,
+) -> int:
+    """
+    replay the messages of a group after last_seen_id, from the node's
+    recent messages when it still has all of them, otherwise from the
+    (group_id, id) index; past RESUME_MAX_MESSAGES the client gets a Resync
+
+    output:
+    - id of the last message replayed, last_seen_id if there was none
+    """
+    frames = manager.recent_messages(group_id, last_seen_id)
+    after_id = None
+    if frames is None:
+        messages = await get_group_messages_after(
+            db=db,
+            group_id=group_id,
+            after_id=last_seen_id,
+            limit=setting.RESUME_MAX_MESSAGES + 1,
+        )
+        if len(messages) > setting.RESUME_MAX_MESSAGES:
+            del messages[setting.RESUME_MAX_MESSAGES :]
+            after_id = messages[-1].id
+        frames = message_frames(messages)
+    last_id = last_seen_id
+    for batch, first_id, last_id in batch_frames(group_id, frames, max_batch):
+        await connection.put(batch, group_id, last_id, first_id)
+    if after_id is not None:
+        await connection.put(
+            encode_frame({"type": "Resync", "group_id": group_id, "after_id": after_id})
+        )
+    return last_id
+
+
+async def unsubscribe_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    await manager.unsubscribe(connection, group_id)
+
 
+async def send_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    message = await create_message_controller(
+        db=db, user=user, group_id=group_id, text=str(frame["text"])
+    )
+    await broadcast_message(group_id, message, db)
 
+
+async def edit_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    message = await change_message(
+        db=db,
+        user=user,
+        message_id=int(frame["message_id"]),
+        change_type=models.ChangeType.Edit,
+        new_text=str(frame["text"]),
+        group_id=group_id,
+    )
+    if not message:
+        connection.push(error_frame(group_id, "You do not have access rights"))
+
+
+async def delete_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    message = await change_message(
+        db=db,
+        user=user,
+        message_id=int(frame["message_id"]),
+        change_type=models.ChangeType.Delete,
+        group_id=group_id,
+    )
+    if not message:
+        connection.push(error_frame(group_id, "You do not have access rights"))
+
+
+async def ack_operation(
+    connection: Connection,
+    user: models.User,
+    group_id: int,
+    frame: dict,
+    db: AsyncSession,
+) -> None:
+    """
+    mark the group read up to message_id, an ack that finishes the replay
+    also covers the live messages sent on the socket meanwhile
+    """
+    message_id = int(frame["message_id"])
+    if connection.acked(group_id, message_id):
+        message_id = max(message_id, connection.sent_ids.get(group_id, 0))
+    await mark_messages_read(
+        db=db,
+        group_id=group_id,
+        user_ids={user.id},
+        message_id=message_id,
+    )
+
+
+FRAME_OPERATIONS = {
+    "subscribe": subscribe_operation,
+    "unsubscribe": unsubscribe_operation,
+    "send": send_operation,
+    "edit": edit_operation,
+    "delete": delete_operation,
+    "ack": ack_operation,
+}
+
+
+def error_frame(group_id: int | None, detail: str) -> str:
+    return encode_frame({"type": "Error", "group_id": group_id, "detail": detail})
+
+
+async def change_message(
+    db: AsyncSession,
+    user: models.User,
+    message_id: int,
+    change_type: models.ChangeType,
+    new_text: str = "",
+    group_id: int | None = None,
+) -> Message | None:
+    """
+    edit or delete a message of the user, record the change and broadcast it
+    - message_id [int]
+    - change_type [ChangeType]
+    - new_text [str]
+    - group_id [int] only change the message if it belongs to this group
+
+    output:
+    - the message, None if the user can't change it
+    """
+    message = await get_message_by_id(db=db, message_id=message_id, user_id=user.id)
+    if not message or (group_id is not None and message.group_id != group_id):
+        return None
+    change = await create_change_controller(
+        db=db,
+        new_text=new_text,
+        original_text=message.text,
+        group_id=message.group_id,
+        sender_id=user.id,
+        changes_type=change_type,
+        message_id=message_id,
+    )
+    if change_type == models.ChangeType.Edit:
+        message = await edit_message(db=db, message=message, changed_message=new_text)
+    await broadcast_changes(
+        group_id=message.group_id,
+        change_type=change_type,
+        message_id=message_id,
+        new_text=new_text,
+        change_id=change.id,
+    )
+    if change_type == models.ChangeType.Delete:
+        await delete_message(db=db, message=message)
+    return message
+
+
+@timed(broadcast_seconds)
 async def broadcast_changes(
     group_id: int,
     change_type: models.ChangeType,
-    db: Session,
     message_id: int | None = None,
     new_text: str | None = None,
+    change_id: int | None = None,
 ) -> None:
     """
-    broadcast changes to all online users on that group
+    broadcast changes to the sockets subscribed to that group
     - group_id [int]
     - change_type [str]
     - message_id [int]
     - new_text [str]
+    - change_id [int] where /group/{group_id}/changes picks up after this one
 
     output:
     - None
     """
-    group = await get_group_by_id(db=db, group_id=group_id)
-    if group:
-        changed_value = {
-            "type": change_type,
-            "id": message_id,
-            "new_text": new_text,
-        }
-        online_users = set(websocket_connections.keys())
-        await asyncio.gather(
-            *[
-                send_change_to_user(
-                    member.user.id, changed_value, online_users=online_users
-                )
-                for member in group.members
-            ]
-        )
+    changed_value = {
+        "type": change_type,
+        "id": message_id,
+        "new_text": new_text,
+        "group_id": group_id,
+        "change_id": change_id,
+    }
+    frame = encode_frame(changed_value)
+    frame_cache.invalidate(message_id)
+    manager.message_changed(
+        group_id,
+        message_id,
+        new_text if change_type == models.ChangeType.Edit else None,
+    )
+    manager.publish(group_id, frame)
+    await publish_event(
+        group_id,
+        {
+            "type": "change",
+            "change_type": change_type,
+            "message_id": message_id,
+            "change_id": change_id,
+        },
+        frame,
+    )
 
 
-async def send_change_to_user(
-    user_id: int, change_data: dict, online_users: set
-) -> None:
+async def publish_event(group_id: int, event: dict, frame: str) -> None:
+    """
+    send an event to the other nodes
+    the frame is left out when the broker can't carry it, receivers then
+    rebuild it from the database
+    """
+    framed_event = {**event, "frame": frame}
+    if (
+        broker.max_payload is None
+        or len(broker.encode(group_id, framed_event).encode()) <= broker.max_payload
+    ):
+        event = framed_event
+    await broker.publish(group_id, event)
+
+
+async def deliver_event(group_id: int, event: dict) -> None:
     """
-    send changes for online users
-    - user_id [int]
-    - change_data [dict]
-    - online_users [set]
+    deliver an event published by another node to the local subscribers
+    - group_id [int]
+    - event [dict]
 
     output:
     - None
     """
-    if user_id in online_users:
-        connection = websocket_connections[
-            user_id
-        ]  # TODO this thing send changes to all users and this isn't good
-        await connection.send_text(json.dumps(change_data))
-
-
-async def send_messages_concurrently(
-    websocket: WebSocket, messages: list[models.UnreadMessage]
-):
-    """Send Messages"""
-    tasks = [
-        websocket.send_text(
-            json.dumps(
-                {
-                    "text": message.message.text,
-                    "sender_name": message.message.sender_name,
-                    "id": message.message.id,
-                    "type": "Text",
-                    "datetime": str(message.message.created_at),
-                }
+    with profile_queries(f"broker {event['type']}"):
+        if event["type"] == "change":
+            frame_cache.invalidate(event["message_id"])
+        frame = event.get("frame")
+        if frame is not None:
+            # one Frame for every local socket, so it is packed at most once
+            frame = Frame(frame)
+        else:
+            async with AsyncSessionLocal() as db:
+                message = await get_group_message(
+                    group_id=group_id, message_id=event["message_id"], db=db
+                )
+            if event["type"] == "message":
+                if message is None:
+                    return
+                frame = message_frame(message)
+            else:
+                frame = encode_frame(
+                    {
+                        "type": event["change_type"],
+                        "id": event["message_id"],
+                        "new_text": message.text if message else "",
+                        "group_id": group_id,
+                        "change_id": event.get("change_id"),
+                    }
+                )
+        message_id = event["message_id"] if event["type"] == "message" else None
+        if event["type"] == "change":
+            manager.message_changed(
+                group_id,
+                event["message_id"],
+                loads(frame)["new_text"]
+                if event["change_type"] == models.ChangeType.Edit
+                else None,
             )
-        )
-        for message in messages
-    ]
-    await asyncio.gather(*tasks)
+        delivered = manager.publish(group_id, frame, message_id)
+        if event["type"] == "message" and delivered:
+            async with AsyncSessionLocal() as db:
+                await mark_messages_read(
+                    db=db,
+                    group_id=group_id,
+                    user_ids=delivered - manager.replaying(group_id),
+                    message_id=event["message_id"],
+                )
+
+
+def message_payload(message: Message) -> dict:
+    """client representation of a text message"""
+    return {
+        "text": message.text,
+        "sender_name": message.sender_name,
+        "id": message.id,
+        "type": "Text",
+        "datetime": str(message.created_at),
+        "group_id": message.group_id,
+    }
+
+
+def message_frame(message: Message) -> str:
+    """
+    the encoded Text frame of a message, encoded once and shared by every
+    socket it goes to; replays reuse it until the message changes
+    """
+    frame = frame_cache.get(message.id)
+    if frame is None:
+        frame = encode_frame(message_payload(message))
+        frame_cache.set(message.id, frame)
+    return frame
+
+
+def message_frames(messages: Iterable[Message]) -> Iterator[tuple[int, str]]:
+    """(message id, message frame) pairs to pack into Batch frames"""
+    for message in messages:
+        yield message.id, message_frame(message)
+
+
+def batch_frames(
+    group_id: int, frames: Iterable[tuple[int, str]], max_batch: int = 0
+) -> Iterator[tuple[str, int]]:
+    """
+    pack (message id, message frame) pairs into Batch frames, oldest first
+    a frame is closed once it holds max_batch (at most REPLAY_BATCH_SIZE)
+    messages or REPLAY_BATCH_BYTES bytes, it always holds at least one
+
+    output:
+    - (frame, id of its first message, id of its last message)
+    """
+    limit = setting.REPLAY_BATCH_SIZE
+    if 0 < max_batch < limit:
+        limit = max_batch
+    head = f'{{"type":"Batch","group_id":{group_id},"messages":['
+    batch: list[str] = []
+    size = first_id = last_id = 0
+    for message_id, frame in frames:
+        frame_size = len(frame.encode())
+        if batch and (
+            len(batch) == limit or size + frame_size > setting.REPLAY_BATCH_BYTES
+        ):
+            yield Frame(head + ",".join(batch) + "]}"), first_id, last_id
+            batch, size = [], 0
+        if not batch:
+            first_id = message_id
+        batch.append(frame)
+        size += frame_size
+        last_id = message_id
+    if batch:
+        yield Frame(head + ",".join(batch) + "]}"), first_id, last_id
+
+
+async def replay_messages(
+    connection: Connection,
+    group_id: int,
+    messages: list[Message],
+    max_batch: int = 0,
+) -> int | None:
+    """
+    queue stored messages on the socket in Batch frames
+    frames wait for room in the queue, so a slow client slows the replay
+    down instead of overflowing
+
+    output:
+    - id of the last message queued, None if there was none
+    """
+    last_id = None
+    frames = message_frames(messages)
+    for frame, first_id, last_id in batch_frames(group_id, frames, max_batch):
+        await connection.put(frame, group_id, last_id, first_id)
+    return last_id
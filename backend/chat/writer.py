@@ -0,0 +1,102 @@
+import asyncio
+
+from chat import logger, models
+from chat.database import AsyncSessionLocal
+from chat.setting import setting
+
+
+class MessageWriter:
+    """
+    Group commit for incoming messages
+
+    Messages sent from every socket are buffered for up to `window` seconds
+    or `max_rows` messages and inserted in one transaction. A sender's
+    write() returns once the transaction that holds its message committed,
+    so a message is never broadcast before it is stored. Batches are written
+    one after the other in arrival order, so message ids keep that order.
+    """
+
+    def __init__(self, window: float, max_rows: int):
+        self.window = window
+        self.max_rows = max_rows
+        self.pending: list[tuple[models.Message, asyncio.Future]] = []
+        self.task: asyncio.Task | None = None
+        self.closing = False
+        self.batches = 0
+        self.rows = 0
+
+    async def write(
+        self, user: models.User, group_id: int, text: str
+    ) -> models.Message:
+        """store a message with the next batch, wait until it is committed"""
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.wakeup = asyncio.Event()
+            self.full = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        message = models.Message(
+            text=text, sender_id=user.id, sender_name=user.username, group_id=group_id
+        )
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((message, future))
+        self.wakeup.set()
+        if len(self.pending) >= self.max_rows:
+            self.full.set()
+        return await future
+
+    async def run(self) -> None:
+        while not (self.closing and not self.pending):
+            await self.wakeup.wait()
+            if not self.closing:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window)
+                except TimeoutError:
+                    pass
+            batch = self.pending[: self.max_rows]
+            del self.pending[: self.max_rows]
+            if len(self.pending) < self.max_rows:
+                self.full.clear()
+            if not self.pending:
+                self.wakeup.clear()
+            if batch:
+                await self.flush(batch)
+
+    async def flush(self, batch: list[tuple[models.Message, asyncio.Future]]) -> None:
+        messages = [message for message, _ in batch]
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add_all(messages)
+                await db.commit()
+        except Exception as error:
+            logger.exception("Failed to store a batch of %s messages", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for message, future in batch:
+            if not future.done():
+                future.set_result(message)
+
+    async def stop(self) -> None:
+        """write what is buffered and stop"""
+        if self.task is None or self.task.done():
+            return
+        self.closing = True
+        self.wakeup.set()
+        self.full.set()
+        await self.task
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": len(self.pending),
+            "batches": self.batches,
+            "rows": self.rows,
+        }
+
+
+message_writer = MessageWriter(
+    window=setting.GROUP_COMMIT_WINDOW_MS / 1000,
+    max_rows=setting.GROUP_COMMIT_MAX_ROWS,
+)
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+import pytest
+
+# settings are read on import, so point the app at a throwaway database first,
+# or at TEST_DATABASE_URL to run against another one (postgres)
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/chat.db"
+)
+os.environ["BCRYPT_ROUNDS"] = "4"
+# every request and socket event fails on an N+1 or past SQL_QUERY_BUDGET
+os.environ["SQL_PROFILE"] = "raise"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from chat.database import engine  # noqa: E402
+from chat.migrations import migrate  # noqa: E402
+from main import app  # noqa: E402
+
+migrate(engine)
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def token(client):
+    """sign up a user and log in"""
+
+    def login(username: str) -> str:
+        client.post(
+            "/user/create",
+            json={
+                "username": username,
+                "password": "password",
+                "email": f"{username}@example.com",
+                "full_name": username,
+            },
+        )
+        response = client.post(
+            "/token", data={"username": username, "password": "password"}
+        )
+        return response.json()["access_token"]
+
+    return login
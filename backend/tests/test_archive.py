@@ -0,0 +1,79 @@
+import gzip
+from datetime import datetime
+
+import pytest
+
+from chat import archive
+from chat.archive import TermFilter
+from chat.setting import setting
+from chat.utils.encoding import dumps, loads
+
+
+@pytest.fixture
+def segment(tmp_path, monkeypatch, request):
+    """a segment of group 1 with two messages per block, one rare word"""
+    monkeypatch.setattr(setting, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(setting, "ARCHIVE_BLOCK_ROWS", 2)
+    rows = [
+        {
+            "id": message_id,
+            "text": "deploy failed" if message_id == 7 else f"message {message_id}",
+            "created_at": datetime(2025, 1, 1),
+            "sender_id": 1,
+            "sender_name": "alice",
+            "group_id": 1,
+        }
+        for message_id in range(1, 11)
+    ]
+    archive.write_segment(request.node.name, rows)
+    return request.node.name
+
+
+@pytest.fixture
+def decompressed(monkeypatch):
+    """count the blocks decompressed"""
+    blocks = []
+    decompress = gzip.decompress
+
+    def counting(data: bytes) -> bytes:
+        blocks.append(data)
+        return decompress(data)
+
+    monkeypatch.setattr(archive.gzip, "decompress", counting)
+    return blocks
+
+
+def test_term_filter_has_every_word():
+    terms = {f"word{number}" for number in range(1000)}
+    term_filter = TermFilter.decode(TermFilter.of(terms).encode())
+
+    assert all(term in term_filter for term in terms)
+    false_positives = sum(f"other{number}" in term_filter for number in range(1000))
+    assert false_positives < 50
+
+
+def test_search_reads_only_blocks_with_the_words(segment, decompressed):
+    messages = archive.read_messages([segment], 1, query="failed deploy")
+
+    assert [message.id for message in messages] == [7]
+    assert len(decompressed) == 1
+
+
+def test_search_without_matches_reads_no_block(segment, decompressed):
+    assert archive.read_messages([segment], 1, query="rollback") == []
+    assert decompressed == []
+
+
+def test_segments_without_term_filters_are_searched(segment, decompressed):
+    path = archive.segment_path(segment, ".index.json")
+    with open(path, "rb") as file:
+        index = loads(file.read())
+    del index["terms"]
+    with open(path, "w") as file:
+        file.write(dumps(index))
+    archive.segment_index.cache_clear()
+
+    messages = archive.read_messages([segment], 1, query="deploy")
+
+    assert [message.id for message in messages] == [7]
+    assert len(decompressed) == 5
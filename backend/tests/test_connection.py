@@ -0,0 +1,47 @@
+import asyncio
+
+from chat.connection import CLOSE, Connection, OverflowPolicy
+from chat.utils.encoding import encode_frame, loads
+
+
+def message(message_id: int) -> str:
+    return encode_frame({"type": "Message", "id": message_id})
+
+
+def frames(connection: Connection) -> list[dict]:
+    return [loads(item[2]) for item in connection.drain() if item is not CLOSE]
+
+
+def replay_and_overflow(policy: str) -> Connection:
+    """a Batch of messages 5 to 7 queued, then live messages overflow it"""
+    connection = Connection(None, user_id=1, max_queue=2, policy=policy)
+
+    async def replay():
+        batch = encode_frame({"type": "Batch", "group_id": 1, "messages": []})
+        await connection.put(batch, 1, 7, 5)
+
+    asyncio.run(replay())
+    for message_id in (8, 9):
+        connection.push(message(message_id), 1, message_id)
+    return connection
+
+
+def test_coalesce_resyncs_before_a_dropped_batch():
+    connection = replay_and_overflow(OverflowPolicy.coalesce)
+
+    assert frames(connection) == [{"type": "Resync", "group_id": 1, "after_id": 4}]
+
+
+def test_disconnect_resumes_before_a_dropped_batch():
+    connection = replay_and_overflow(OverflowPolicy.disconnect)
+
+    assert frames(connection)[0] == {"type": "Resume", "groups": {"1": 4}}
+
+
+def test_resume_after_the_last_sent_message():
+    connection = Connection(None, user_id=1, max_queue=1)
+    connection.sent_ids[1] = 3
+    for message_id in (4, 5):
+        connection.push(message(message_id), 1, message_id)
+
+    assert frames(connection) == [{"type": "Resync", "group_id": 1, "after_id": 3}]
@@ -0,0 +1,10 @@
+from chat.database import engine
+from chat.manage import query_plans
+
+
+def test_hot_queries_use_indexes():
+    with engine.connect() as connection:
+        plans = query_plans(connection)
+
+    assert plans
+    assert {name: scans for name, (_, scans) in plans.items() if scans} == {}
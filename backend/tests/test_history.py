@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def member(client, token, request):
+    """a user's auth headers and a new, empty group of theirs"""
+    headers = {"Authorization": f"Bearer {token('history_alice')}"}
+    group = {"address": request.node.name, "name": "History"}
+    response = client.post("/group/create/", params=group, headers=headers)
+    return headers, response.json()["id"]
+
+
+@pytest.mark.parametrize("limit", [10, 1000])
+def test_empty_page(client, member, limit):
+    headers, group_id = member
+    response = client.get(
+        f"/group/{group_id}/messages", params={"limit": limit}, headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_both_cursors(client, member):
+    headers, group_id = member
+    response = client.get(
+        f"/group/{group_id}/messages",
+        params={"before_id": 10, "after_id": 1},
+        headers=headers,
+    )
+
+    assert response.status_code == 400
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from chat import metrics
+from chat.metrics import Histogram, timed
+
+
+@pytest.fixture
+def histogram():
+    histogram = Histogram(
+        "test_seconds", "Histogram of a test", ("function",), buckets=(0.1, 1.0)
+    )
+    yield histogram
+    metrics.registry.remove(histogram)
+
+
+def sample(text: str, name: str) -> float:
+    """value of the line of `name`, labels included, in a scrape"""
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{name} not in the scrape")
+
+
+def test_histogram_buckets(histogram):
+    for value in (0.1, 0.5, 2):
+        histogram.observe(value, function="f")
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_seconds Histogram of a test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{function="f",le="0.1"} 1.0',
+        'test_seconds_bucket{function="f",le="1.0"} 2.0',
+        'test_seconds_bucket{function="f",le="+Inf"} 3.0',
+        'test_seconds_sum{function="f"} 2.6',
+        'test_seconds_count{function="f"} 3.0',
+    ]
+
+
+def test_histogram_labels_are_escaped(histogram):
+    histogram.observe(0.5, function='a "quoted"\nname')
+
+    assert 'test_seconds_count{function="a \\"quoted\\"\\nname"} 1.0' in (
+        histogram.render()
+    )
+
+
+def test_unlabelled_metrics_start_at_zero():
+    counter = metrics.Counter("test_total", "Counter of a test")
+    metrics.registry.remove(counter)
+
+    assert counter.render().splitlines()[-1] == "test_total 0.0"
+
+
+def test_timed_observes_each_call(histogram):
+    @timed(histogram)
+    async def query(fail: bool) -> str:
+        if fail:
+            raise ValueError
+        return "rows"
+
+    assert asyncio.run(query(False)) == "rows"
+    with pytest.raises(ValueError):
+        asyncio.run(query(True))
+
+    assert query.__name__ == "query"
+    assert sample(histogram.render(), 'test_seconds_count{function="query"}') == 2
+
+
+def test_metrics_after_send(client, token):
+    alice = token("metrics_alice")
+    headers = {"Authorization": f"Bearer {alice}"}
+    group = {"address": "metrics", "name": "Metrics"}
+    group_id = client.post("/group/create/", params=group, headers=headers).json()["id"]
+    before = client.get("/metrics").text
+
+    with client.websocket_connect(f"/ws?token={alice}") as websocket:
+        websocket.send_json({"op": "subscribe", "group_id": group_id})
+        websocket.send_json({"op": "send", "group_id": group_id, "text": "hello"})
+        assert websocket.receive_json()["text"] == "hello"
+        response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = response.text
+    for counter in ("chat_messages_ingested_total", "chat_messages_delivered_total"):
+        assert sample(after, counter) == sample(before, counter) + 1
+    assert sample(after, 'chat_connections{endpoint="/ws"}') == 1
+    assert sample(after, f'chat_group_subscribers{{group_id="{group_id}"}}') == 1
+    created = 'chat_db_seconds_count{function="create_message_controller"}'
+    assert sample(after, created) >= 1
+    assert sample(
+        after, 'chat_db_seconds_bucket{function="create_message_controller",le="+Inf"}'
+    ) == sample(after, created)
+    assert "# TYPE chat_broadcast_seconds histogram" in after
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import select
+
+from chat import models
+from chat.database import SessionLocal
+from chat.profiler import QueryBudgetExceeded, fingerprint, query_budget
+
+
+def test_fingerprint_ignores_literals_and_parameters():
+    assert fingerprint(
+        "SELECT * FROM users WHERE id IN (?, ?, ?) AND name = 'bob' LIMIT 10"
+    ) == fingerprint("SELECT *  FROM users WHERE id IN (?) AND name = :name LIMIT 5")
+
+
+def test_query_budget_counts_statements():
+    with SessionLocal() as db:
+        with query_budget(2, "two") as profile:
+            db.scalar(select(models.User.id).limit(1))
+            db.scalar(select(models.Group.id).limit(1))
+
+    assert profile.queries == 2
+
+
+def test_query_budget_raises_over_budget():
+    with SessionLocal() as db:
+        with pytest.raises(QueryBudgetExceeded, match="over: 2 queries"):
+            with query_budget(1, "over"):
+                db.scalar(select(models.User.id).limit(1))
+                db.scalar(select(models.Group.id).limit(1))
+
+
+def test_query_budget_raises_on_a_query_per_row():
+    with SessionLocal() as db:
+        with pytest.raises(QueryBudgetExceeded, match="5x SELECT"):
+            with query_budget(100, "n+1"):
+                for user_id in range(5):
+                    db.get(models.User, user_id)
@@ -0,0 +1,143 @@
+"""
+The broadcast, replay and history paths run a fixed number of statements,
+whatever the size of the group or of the backlog; a query per member or
+per message would show up as more statements for the bigger sizes.
+"""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import insert, select
+
+from chat import models
+from chat.cache import frame_cache
+from chat.crud import (
+    get_reads_messages,
+    get_unread_group_messages,
+    invalidate_roster,
+    mark_messages_read,
+)
+from chat.database import AsyncSessionLocal, async_engine
+from chat.profiler import query_budget
+from chat.setting import setting
+from chat.views.websocket import batch_frames, broadcast_message, message_frames
+
+SIZES = (10, 100, 1_000)
+# statements of each path, per read state
+QUERIES = {
+    models.ReadState.rows: {"broadcast": 2, "replay": 2, "history": 1},
+    models.ReadState.watermark: {"broadcast": 1, "replay": 2, "history": 1},
+}
+
+
+async def prepare(size: int) -> tuple[int, list[models.User]]:
+    """a group of `size` members and a backlog of `size` messages unread by one"""
+    async with AsyncSessionLocal() as db:
+        prefix = f"q{time.time_ns()}"
+        group = models.Group(address=prefix, name=prefix)
+        db.add(group)
+        await db.flush()
+        await db.execute(
+            insert(models.User),
+            [
+                {
+                    "username": f"{prefix}_{i}",
+                    "password": "",
+                    "email": f"{prefix}_{i}@q",
+                }
+                for i in range(size)
+            ],
+        )
+        users = list(
+            await db.scalars(
+                select(models.User).where(models.User.username.like(f"{prefix}_%"))
+            )
+        )
+        await db.execute(
+            insert(models.GroupMember),
+            [{"group_id": group.id, "user_id": user.id} for user in users],
+        )
+        await db.execute(
+            insert(models.Message),
+            [
+                {
+                    "text": f"backlog {i}",
+                    "sender_id": users[0].id,
+                    "sender_name": users[0].username,
+                    "group_id": group.id,
+                }
+                for i in range(size)
+            ],
+        )
+        message_ids = list(
+            await db.scalars(
+                select(models.Message.id).where(models.Message.group_id == group.id)
+            )
+        )
+        await db.execute(
+            insert(models.UnreadMessage),
+            [
+                {
+                    "user_id": users[1].id,
+                    "user_name": users[1].username,
+                    "message_id": message_id,
+                    "group_id": group.id,
+                }
+                for message_id in message_ids
+            ],
+        )
+        await db.commit()
+        return group.id, users
+
+
+async def count_queries(size: int, queries: dict[str, int]) -> dict[str, int]:
+    """run each path within its budget, and return the statements it ran"""
+    group_id, users = await prepare(size)
+    reader = users[1]
+    counts = {}
+    async with AsyncSessionLocal() as db:
+        invalidate_roster(group_id)
+        message = models.Message(
+            text="hi",
+            sender_id=users[0].id,
+            sender_name=users[0].username,
+            group_id=group_id,
+        )
+        db.add(message)
+        await db.commit()
+        with query_budget(queries["broadcast"], "broadcast") as profile:
+            await broadcast_message(group_id, message, db)
+        counts["broadcast"] = profile.queries
+
+    async with AsyncSessionLocal() as db:
+        frame_cache.clear()
+        with query_budget(queries["replay"], "replay") as profile:
+            messages = await get_unread_group_messages(
+                db=db, user_id=reader.id, group_id=group_id
+            )
+            for _ in batch_frames(group_id, message_frames(messages)):
+                pass
+            await mark_messages_read(
+                db=db,
+                group_id=group_id,
+                user_ids={reader.id},
+                message_id=messages[-1].id,
+            )
+        counts["replay"] = profile.queries
+
+    async with AsyncSessionLocal() as db:
+        with query_budget(queries["history"], "history") as profile:
+            await get_reads_messages(group_id=group_id, user=reader, db=db, limit=size)
+        counts["history"] = profile.queries
+    # the next test runs in another event loop
+    await async_engine.dispose()
+    return counts
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("read_state", list(QUERIES))
+def test_queries_per_path(read_state, size, monkeypatch):
+    monkeypatch.setattr(setting, "READ_STATE", read_state)
+    queries = QUERIES[read_state]
+
+    assert asyncio.run(count_queries(size, queries)) == queries
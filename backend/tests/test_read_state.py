@@ -0,0 +1,37 @@
+from chat import models
+from chat.database import SessionLocal
+
+
+def headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def send(websocket, group_id: int, text: str) -> int:
+    """send a message and wait until its read state is saved"""
+    websocket.send_json({"op": "send", "group_id": group_id, "text": text})
+    message_id = websocket.receive_json()["id"]
+    # frames run one at a time, the error comes once the send is done
+    websocket.send_json({})
+    assert websocket.receive_json()["type"] == "Error"
+    return message_id
+
+
+def test_unread_rows_for_a_member_who_joined_on_another_node(client, token):
+    alice, bob = token("read_state_alice"), token("read_state_bob")
+    group = {"address": "read_state", "name": "Read state"}
+    group_id = client.post(
+        "/group/create/", params=group, headers=headers(alice)
+    ).json()["id"]
+    bob_id = client.get("/user/me", headers=headers(bob)).json()["id"]
+
+    with client.websocket_connect(f"/ws?token={alice}") as websocket:
+        websocket.send_json({"op": "subscribe", "group_id": group_id})
+        send(websocket, group_id, "before")
+        # the join of another node, this node's roster of the group is stale
+        with SessionLocal() as db:
+            db.add(models.GroupMember(user_id=bob_id, group_id=group_id))
+            db.commit()
+        message_id = send(websocket, group_id, "after")
+
+    unread = client.get("/user/unread_messages", headers=headers(bob)).json()
+    assert [row["message_id"] for row in unread] == [message_id]
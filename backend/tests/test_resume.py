@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete
+
+from chat import archive, models
+from chat.database import SessionLocal
+from chat.setting import setting
+
+
+def headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def archived_group(client, token, tmp_path, monkeypatch):
+    """a group whose first two messages were archived, and a live one"""
+    monkeypatch.setattr(setting, "ARCHIVE_DIR", str(tmp_path))
+    alice = token("resume_alice")
+    group = {"address": "resume", "name": "Resume"}
+    group_id = client.post(
+        "/group/create/", params=group, headers=headers(alice)
+    ).json()["id"]
+    with client.websocket_connect(f"/ws?token={alice}") as websocket:
+        websocket.send_json({"op": "subscribe", "group_id": group_id})
+        for text in ("first", "second", "third"):
+            websocket.send_json({"op": "send", "group_id": group_id, "text": text})
+        ids = [websocket.receive_json()["id"] for _ in range(3)]
+    rows = [
+        {
+            "id": message_id,
+            "text": text,
+            "created_at": datetime(2020, 1, 1),
+            "sender_id": 1,
+            "sender_name": "resume_alice",
+            "group_id": group_id,
+        }
+        for message_id, text in zip(ids, ("first", "second"))
+    ]
+    segment = archive.write_segment("resume", rows)
+    archived = ids[:2]
+    with SessionLocal() as db:
+        db.add(models.MessageSegment(name="resume", **segment))
+        unread = models.UnreadMessage.message_id.in_(archived)
+        db.execute(delete(models.UnreadMessage).where(unread))
+        db.execute(delete(models.Message).where(models.Message.id.in_(archived)))
+        db.commit()
+    yield alice, group_id, ids
+    with SessionLocal() as db:
+        segment = models.MessageSegment.name == "resume"
+        db.execute(delete(models.MessageSegment).where(segment))
+        db.commit()
+
+
+def test_resume_from_before_the_archive(client, archived_group):
+    alice, group_id, ids = archived_group
+    with client.websocket_connect(f"/ws?token={alice}") as websocket:
+        websocket.send_json(
+            {"op": "subscribe", "group_id": group_id, "last_seen_id": 0}
+        )
+        batch = websocket.receive_json()
+
+    assert [message["id"] for message in batch["messages"]] == ids
+    assert batch["messages"][0]["text"] == "first"
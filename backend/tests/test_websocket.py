@@ -0,0 +1,36 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+
+@pytest.fixture
+def member(client, token, request):
+    """a user's token and a new group of theirs"""
+    alice = token("websocket_alice")
+    group = {"address": request.node.name, "name": "Websocket"}
+    headers = {"Authorization": f"Bearer {alice}"}
+    response = client.post("/group/create/", params=group, headers=headers)
+    return alice, response.json()["id"]
+
+
+def test_subscribe_with_invalid_max_batch(client, member):
+    alice, group_id = member
+    with client.websocket_connect(f"/ws?token={alice}") as websocket:
+        websocket.send_json(
+            {"op": "subscribe", "group_id": group_id, "max_batch": "many"}
+        )
+
+        assert websocket.receive_json() == {
+            "type": "Error",
+            "group_id": group_id,
+            "detail": "Invalid frame",
+        }
+
+
+def test_unread_messages_with_invalid_max_batch(client, member):
+    alice, group_id = member
+    url = f"/get-unread-messages?group_id={group_id}&max_batch=many&token={alice}"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(url):
+            pass
+
+    assert closed.value.code == 1008
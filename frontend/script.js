@@ -9,10 +9,13 @@ const WebSocketBaseUrl = "ws://127.0.0.1:8000";
 const BOT_IMG = "images/icons8-male-user-96.png";
 const PERSON_IMG = "images/icons8-male-user-94.png";
 let last_message_id = 0;
+// history is loaded a page at a time, older pages when scrolled to the top
+let oldest_message_id = null;
+let has_older_messages = true;
+let loading_older_messages = false;
 token = getCookie("token");
 group_id = getCookie("group");
-let socketSendMessage;
-let socketGetUnreadMessages;
+let socket;
 const headers = new Headers({
   Authorization: `Bearer ${token}`,
 });
@@ -28,33 +31,32 @@ async function connectWebSocket() {
   token = getCookie("token");
   group_id = getCookie("group");
 
-  socketSendMessage = new WebSocket(
-    WebSocketBaseUrl + `/send-message?token=${token}&group_id=${group_id}`
-  );
-  socketSendMessage.onclose = function (event) {
-    console.log(`WebSocket Closed with Code ${event.code}`);
-    checkToken();
-    alert("Your Connection Was Cropped Try To Connect Again");
-    setTimeout(connectWebSocket, 6000);
-  };
-
-  socketGetUnreadMessages = new WebSocket(
-    WebSocketBaseUrl +
-      `/get-unread-messages?token=${token}&group_id=${group_id}`
-  );
-  console.log(socketGetUnreadMessages);
-  socketGetUnreadMessages.onopen = function (event) {
-    console.log(
-      "WebSocket Connection for Receiving Unread Messages Established"
-    );
+  // one socket per user, every frame names its group
+  socket = new WebSocket(WebSocketBaseUrl + `/ws?token=${token}`);
+  socket.onopen = function (event) {
+    console.log("WebSocket Connection Established");
+    const subscribe = { op: "subscribe", group_id: Number(group_id), max_batch: 256 };
+    if (last_message_id) {
+      // reconnecting, the server replays what we missed since the last message
+      subscribe.last_seen_id = last_message_id;
+    }
+    socket.send(JSON.stringify(subscribe));
   };
 
-  socketGetUnreadMessages.onmessage = function (event) {
+  socket.onmessage = function (event) {
     const messageData = JSON.parse(event.data);
     // console.log(messageData);
     const type = messageData.type;
     // console.log(type);
-    if (type == "Edit" || type == "Delete") {
+    if (messageData.group_id != group_id) {
+      return;
+    }
+    if (type == "Error") {
+      console.error(messageData.detail);
+    } else if (type == "Resync" || type == "Resume") {
+      // the server dropped frames for us, reload to get the missed messages
+      location.reload();
+    } else if (type == "Edit" || type == "Delete") {
       const messageText = messageData.new_text;
       const id = messageData.id;
       console.log(id);
@@ -73,49 +75,62 @@ async function connectWebSocket() {
             element.parentNode.appendChild(editIndication);
           }
         }
-      } else {
+      } else if (element) {
         element.textContent = "";
         const editIndication = document.createElement("span");
         editIndication.textContent = "This message has been deleted";
         editIndication.className = "deleted-indication";
         element.parentNode.appendChild(editIndication);
       }
+    } else if (type == "Batch") {
+      // replayed unread messages, oldest first, one ack for all of them
+      messageData.messages.forEach(showMessage);
+      const last = messageData.messages[messageData.messages.length - 1];
+      socket.send(
+        JSON.stringify({ op: "ack", group_id: Number(group_id), message_id: last.id })
+      );
     } else {
-      const messageText = messageData.text;
-      const senderName = messageData.sender_name;
-      const id = messageData.id;
-      const datetime = messageData.datetime;
-      console.log(id);
-      // console.log(messageText);
-
-      if (senderName == getCookie("username")) {
-        appendMessage(
-          senderName,
-          PERSON_IMG,
-          "right",
-          messageText,
-          id,
-          datetime
-        );
-      } else {
-        appendMessage(senderName, BOT_IMG, "left", messageText, id, datetime);
-      }
+      // live messages are marked read by the server when it sends them
+      showMessage(messageData);
     }
   };
 
-  socketGetUnreadMessages.onclose = function (event) {
+  socket.onclose = function (event) {
     console.log(`WebSocket Closed with Code ${event.code}`);
+    checkToken();
     alert("Your Connection Was Cropped Try To Connect Again");
-    setTimeout(connectWebSocket, 6000);
+    // spread reconnects so a restarted node isn't hit by every client at once
+    setTimeout(connectWebSocket, 6000 + Math.random() * 6000);
   };
 }
+function showMessage(messageData) {
+  const messageText = messageData.text;
+  const senderName = messageData.sender_name;
+  const id = messageData.id;
+  const datetime = messageData.datetime;
+  console.log(id);
+  if (document.getElementById(id)) {
+    // already shown, a resume replay can overlap live messages
+    return;
+  }
+  last_message_id = Math.max(last_message_id, id);
+  // console.log(messageText);
+
+  if (senderName == getCookie("username")) {
+    appendMessage(senderName, PERSON_IMG, "right", messageText, id, datetime);
+  } else {
+    appendMessage(senderName, BOT_IMG, "left", messageText, id, datetime);
+  }
+}
 msgerForm.addEventListener("submit", (event) => {
   event.preventDefault();
 
   const msgText = msgerInput.value;
   if (!msgText) return;
-  if (socketSendMessage.readyState === WebSocket.OPEN) {
-    socketSendMessage.send(msgText);
+  if (socket.readyState === WebSocket.OPEN) {
+    socket.send(
+      JSON.stringify({ op: "send", group_id: Number(group_id), text: msgText })
+    );
     msgerInput.value = "";
   }
 });
@@ -137,7 +152,15 @@ function draw_line(callback) {
     callback();
   }
 }
-function appendMessage(name, img, side, text, id, datetime = null) {
+function appendMessage(
+  name,
+  img,
+  side,
+  text,
+  id,
+  datetime = null,
+  position = "beforeend"
+) {
   //   Simple solution for small apps
   // console.log(datetime);
   if (datetime == null) {
@@ -181,8 +204,10 @@ function appendMessage(name, img, side, text, id, datetime = null) {
     </div>
   `;
 
-  msgerChat.insertAdjacentHTML("beforeend", msgHTML);
-  msgerChat.scrollTop += 500;
+  msgerChat.insertAdjacentHTML(position, msgHTML);
+  if (position == "beforeend") {
+    msgerChat.scrollTop += 500;
+  }
 }
 
 // Utils
@@ -219,56 +244,78 @@ async function get_unread_message_id() {
     throw error;
   }
 }
-async function write_old_messages() {
+async function fetch_messages_page(before_id = null) {
+  // oldest first, the newest page without before_id
   url = BaseUrl + `/group/${group_id}/messages`;
+  if (before_id != null) {
+    url += `?before_id=${before_id}`;
+  }
+  const response = await fetch(url, {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+  if (!response.ok) {
+    throw new Error("Network response was not ok");
+  }
+  const messages = (await response.json()) || [];
+  if (messages.length) {
+    oldest_message_id = messages[0].message_id;
+  } else {
+    has_older_messages = false;
+  }
+  return messages;
+}
+function write_history_message(message, position = "beforeend") {
+  let username = message.username;
+  let messageText = message.message_text;
+  const datetime = message.datetime;
+  let id = message.message_id;
+  if (username == getCookie("username")) {
+    appendMessage(
+      username,
+      PERSON_IMG,
+      "right",
+      messageText,
+      id,
+      datetime,
+      position
+    );
+  } else
+    appendMessage(username, BOT_IMG, "left", messageText, id, datetime, position);
+}
+async function write_old_messages() {
   try {
-    await fetch(url, {
-      headers: {
-        Authorization: `Bearer ${token}`,
-      },
-    })
-      .then((response) => {
-        if (!response.ok) {
-          throw new Error("Network response was not ok");
-        }
-        return response.json();
-      })
-      .then((messageData) => {
-        if (messageData == null) {
-        } else {
-          const messages = messageData;
-          messages.forEach((message) => {
-            // console.log(message);
-            let username = message.username;
-            let messageText = message.message_text;
-            const datetime = message.datetime;
-            let id = message.message_id;
-            if (username == getCookie("username")) {
-              appendMessage(
-                username,
-                PERSON_IMG,
-                "right",
-                messageText,
-                id,
-                datetime
-              );
-            } else
-              appendMessage(
-                username,
-                BOT_IMG,
-                "left",
-                messageText,
-                id,
-                datetime
-              );
-          });
-        }
-      })
-      .catch((error) => console.error("Failed to get OldMessages", error));
+    const messages = await fetch_messages_page();
+    messages.forEach((message) => write_history_message(message));
   } catch (error) {
-    console.error(error);
+    console.error("Failed to get OldMessages", error);
+  }
+}
+async function write_older_messages() {
+  if (loading_older_messages || !has_older_messages || oldest_message_id == null) {
+    return;
+  }
+  loading_older_messages = true;
+  try {
+    const messages = await fetch_messages_page(oldest_message_id);
+    // keep the messages on screen where they are while the page goes above
+    const height = msgerChat.scrollHeight;
+    messages
+      .reverse()
+      .forEach((message) => write_history_message(message, "afterbegin"));
+    msgerChat.scrollTop += msgerChat.scrollHeight - height;
+  } catch (error) {
+    console.error("Failed to get OldMessages", error);
+  } finally {
+    loading_older_messages = false;
   }
 }
+msgerChat.addEventListener("scroll", () => {
+  if (msgerChat.scrollTop == 0) {
+    write_older_messages();
+  }
+});
 
 async function old_messages() {
   try {